@@ -0,0 +1,168 @@
+# coding: utf-8
+
+
+import os, sys, time, zlib, threading
+
+
+archive_path = os.path.join("raw", "articles")
+shard_size = 1000  # Number of articles in a shard.
+index_name = "index.tsv"
+
+
+def _shard_name(index):
+    return "articles-{:03d}.z".format((index - 1) // shard_size)
+
+
+def _article_name(index):
+    return "article-{:05d}".format(index)
+
+
+class ArticleWriter(object):
+    """
+    Writer of crawled articles to an archive of compressed shards.
+    An article is compressed on its own and appended to the shard of its index,
+    and its shard, offset and size are appended to index.tsv afterwards,
+    so an interrupted write leaves only unindexed bytes.
+    Writing an article again indexes the new copy. Writes are thread-safe.
+    """
+
+    def __init__(self, path=archive_path):
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.shards = {}
+        self.index_file = open(os.path.join(path, index_name), "a")
+        self.lock = threading.Lock()
+
+
+    def put(self, index, content):
+        data = zlib.compress(content)
+        shard_name = _shard_name(index)
+        with self.lock:
+            if shard_name not in self.shards:
+                self.shards[shard_name] = open(os.path.join(self.path, shard_name), "ab")
+            f = self.shards[shard_name]
+            offset = f.seek(0, os.SEEK_END)
+            f.write(data)
+            f.flush()
+            self.index_file.write("{}\t{}\t{}\t{}\n".format(index, shard_name, offset, len(data)))
+            self.index_file.flush()
+
+
+    def close(self):
+        for f in self.shards.values():
+            f.close()
+        self.index_file.close()
+
+
+class ArticleReader(object):
+    """
+    Reader of articles in an archive, by index.
+    Shards are opened once per process, so a reader can be shared with forked workers.
+    """
+
+    def __init__(self, path=archive_path):
+        self.path = path
+        self.entries = {}
+        index_path = os.path.join(path, index_name)
+        if os.path.exists(index_path):
+            with open(index_path, "r") as f:
+                for line in f:
+                    fields = line.rstrip("\n").split("\t")
+                    if len(fields) == 4 and line.endswith("\n"):  # Skip a partly written line.
+                        self.entries[int(fields[0])] = (fields[1], int(fields[2]), int(fields[3]))
+        self.pid = None
+        self.shards = {}
+
+
+    def __contains__(self, index):
+        return index in self.entries
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+    def indices(self):
+        return set(self.entries)
+
+
+    def get(self, index):
+        """
+        Content of an article as bytes.
+        """
+        if self.pid != os.getpid():  # Forked, file positions are shared with the parent.
+            self.pid = os.getpid()
+            self.shards = {}
+        shard_name, offset, size = self.entries[index]
+        if shard_name not in self.shards:
+            self.shards[shard_name] = open(os.path.join(self.path, shard_name), "rb")
+        f = self.shards[shard_name]
+        f.seek(offset)
+        return zlib.decompress(f.read(size))
+
+
+    def scan(self):
+        """
+        Iterate over (index, content) of all articles in index order.
+        """
+        for index in sorted(self.entries):
+            yield index, self.get(index)
+
+
+def migrate(raw_path, path=archive_path):
+    """
+    Archive raw/article-NNNNN files, up to the first missing one as data_extractor.py reads them.
+    Archived articles are skipped, so migration can be resumed.
+    """
+    reader = ArticleReader(path)
+    writer = ArticleWriter(path)
+    index = 1
+    while os.path.exists(os.path.join(raw_path, _article_name(index))):
+        if index not in reader:
+            with open(os.path.join(raw_path, _article_name(index)), "rb") as f:
+                writer.put(index, f.read())
+        index += 1
+    writer.close()
+    print("Archived {} articles in {}.".format(index - 1, path))
+
+
+def _disk_usage(paths):
+    return sum(os.stat(p).st_blocks * 512 for p in paths)
+
+
+def compare(raw_path, path=archive_path):
+    """
+    Compare disk usage and scan throughput of raw/article-NNNNN files and the archive.
+    """
+    file_paths = []
+    while os.path.exists(os.path.join(raw_path, _article_name(len(file_paths) + 1))):
+        file_paths.append(os.path.join(raw_path, _article_name(len(file_paths) + 1)))
+    start = time.time()
+    size = 0
+    for p in file_paths:
+        with open(p, "rb") as f:
+            size += len(f.read())
+    file_time = time.time() - start
+    print("files\t{} files\t{:.1f} MB on disk\t{:.1f} MB/s".format(
+        len(file_paths), _disk_usage(file_paths) / 1e6, size / 1e6 / max(file_time, 1e-9)))
+
+    reader = ArticleReader(path)
+    start = time.time()
+    size = 0
+    for _, content in reader.scan():
+        size += len(content)
+    archive_time = time.time() - start
+    archive_paths = [os.path.join(path, name) for name in os.listdir(path)]
+    print("archive\t{} files\t{:.1f} MB on disk\t{:.1f} MB/s".format(
+        len(archive_paths), _disk_usage(archive_paths) / 1e6, size / 1e6 / max(archive_time, 1e-9)))
+
+
+if __name__ == "__main__":
+
+    # Archive raw articles, python article_archive.py migrate,
+    # or compare layouts, python article_archive.py compare.
+    if sys.argv[1] == "migrate":
+        migrate("raw")
+    elif sys.argv[1] == "compare":
+        compare("raw")
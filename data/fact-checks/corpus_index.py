@@ -0,0 +1,166 @@
+# coding: utf-8
+
+
+import os, re, sys, json
+import pandas as pd
+import numpy as np
+
+
+index_path = "corpus_index"
+set_names = ["train", "dev", "test"]
+
+
+class CorpusIndex(object):
+    """
+    Positional token index over the space-joined tokens of all documents,
+    answering whether a phrase is a substring of a document, the same as `phrase in tokens`.
+    A phrase "w1 w2 ... wk" is in a document iff some k consecutive tokens
+    end with w1, equal w2, ..., and start with wk, so a phrase is looked up
+    by its words in the vocabulary and checked on consecutive positions.
+    This stores:
+        vocab -- distinct tokens.
+        tokens -- token ids of all documents concatenated, shape (token_count,).
+        doc_offsets -- offsets of documents, shape (doc_count + 1,).
+        postings -- positions in tokens grouped by token id, shape (token_count,).
+        posting_offsets -- offsets of token ids in postings, shape (vocab_size + 1,).
+    """
+
+    def __init__(self, vocab, tokens, doc_offsets, postings, posting_offsets):
+        self.vocab = vocab
+        self.tokens = tokens
+        self.doc_offsets = doc_offsets
+        self.postings = postings
+        self.posting_offsets = posting_offsets
+        self.word2id = {w: i for i, w in enumerate(vocab)}
+
+        # Vocabulary as a string with starts of tokens, for substring lookups.
+        self.vocab_str = "\n" + "\n".join(vocab) + "\n"
+        self.vocab_starts = np.cumsum([1] + [len(w) + 1 for w in vocab])[:-1]
+        self.cache = {}
+
+
+    @classmethod
+    def build(cls, docs):
+        vocab, word2id = [], {}
+        tokens, doc_offsets = [], [0]
+        for doc in docs:
+            for w in doc.split(" "):
+                if w not in word2id:
+                    word2id[w] = len(vocab)
+                    vocab.append(w)
+                tokens.append(word2id[w])
+            doc_offsets.append(len(tokens))
+        tokens = np.array(tokens, dtype=np.int64)
+        postings = np.argsort(tokens, kind="stable")
+        posting_offsets = np.concatenate([[0], np.cumsum(np.bincount(tokens, minlength=len(vocab)))])
+        return cls(vocab, tokens, np.array(doc_offsets, dtype=np.int64), postings, posting_offsets)
+
+
+    def save(self, path, meta=None):
+        if not os.path.exists(path):
+            os.mkdir(path)
+        with open(os.path.join(path, "vocab.json"), "w") as f:
+            json.dump(self.vocab, f, ensure_ascii=False)
+        for name in ["tokens", "doc_offsets", "postings", "posting_offsets"]:
+            np.save(os.path.join(path, name + ".npy"), getattr(self, name))
+        with open(os.path.join(path, "meta.json"), "w") as f:
+            json.dump(meta or {}, f)
+
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, "vocab.json"), "r") as f:
+            vocab = json.load(f)
+        arrays = [np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+                  for name in ["tokens", "doc_offsets", "postings", "posting_offsets"]]
+        return cls(vocab, *arrays)
+
+
+    def __len__(self):
+        return len(self.doc_offsets) - 1
+
+
+    def _find_words(self, kind, word):
+        """
+        Ids of tokens that contain (kind="in"), end with (kind="end") or start with (kind="start") word.
+        """
+        if (kind, word) in self.cache:
+            return self.cache[(kind, word)]
+        pattern = {"in": word, "end": word + "\n", "start": "\n" + word}[kind]
+        positions = [m.start() + (kind == "start") for m in re.finditer(re.escape(pattern), self.vocab_str)]
+        ids = np.unique(np.searchsorted(self.vocab_starts, positions, side="right") - 1)
+        self.cache[(kind, word)] = ids
+        return ids
+
+
+    def _positions(self, ids):
+        return np.concatenate([np.zeros(0, dtype=np.int64)] +
+                              [self.postings[self.posting_offsets[i]: self.posting_offsets[i + 1]] for i in ids])
+
+
+    def find(self, phrase):
+        """
+        Ids of documents containing a phrase as a substring, in order.
+        """
+        if phrase == "":
+            return np.arange(len(self))
+        if "\n" in phrase:  # Tokens have no line breaks.
+            return np.zeros(0, dtype=np.int64)
+        words = phrase.split(" ")
+        if len(words) == 1:
+            positions = self._positions(self._find_words("in", phrase))
+        else:
+            positions = self._positions(self._find_words("end", words[0]))
+            ends = self.doc_offsets[np.searchsorted(self.doc_offsets, positions, side="right")] \
+                if len(positions) else positions
+            positions = positions[positions + len(words) - 1 < ends]
+            for j, word in enumerate(words[1:-1], 1):
+                if word not in self.word2id:
+                    return np.zeros(0, dtype=np.int64)
+                positions = positions[self.tokens[positions + j] == self.word2id[word]]
+            is_last = np.zeros(len(self.vocab), dtype=bool)
+            is_last[self._find_words("start", words[-1])] = True
+            positions = positions[is_last[self.tokens[positions + len(words) - 1]]]
+        return np.unique(np.searchsorted(self.doc_offsets, positions, side="right") - 1)
+
+
+    def contains(self, phrases):
+        """
+        Whether each document contains any of the phrases, shape (doc_count,).
+        """
+        mask = np.zeros(len(self), dtype=bool)
+        for phrase in phrases:
+            mask[self.find(phrase)] = True
+        return mask
+
+
+def _source_meta(paths):
+    return {p: [os.path.getsize(p), os.path.getmtime(p)] for p in paths}
+
+
+def load_index(paths=None, path=index_path):
+    """
+    Load the index of the tokens in paths, or build and save it if missing or out of date.
+    """
+    paths = paths or [set_name + ".tsv" for set_name in set_names]
+    meta_path = os.path.join(path, "meta.json")
+    if os.path.exists(meta_path):
+        with open(meta_path, "r") as f:
+            if json.load(f) == json.loads(json.dumps(_source_meta(paths))):
+                return CorpusIndex.load(path)
+    print("Building corpus index.")
+    docs = []
+    for p in paths:
+        docs += pd.read_csv(p, sep="\t", usecols=["tokens"])["tokens"].fillna("").tolist()
+    index = CorpusIndex.build(docs)
+    index.save(path, _source_meta(paths))
+    return index
+
+
+if __name__ == "__main__":
+
+    # Query phrases, e.g., python corpus_index.py "donald trump" "covid".
+    index = load_index()
+    for phrase in sys.argv[1:]:
+        doc_ids = index.find(phrase)
+        print(phrase, "\t", len(doc_ids), "\t", doc_ids[:20].tolist())
@@ -1,10 +1,11 @@
 # coding: utf-8
 
 
-import os, json, random, nltk
+import os, json, random, hashlib, nltk
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+from data_tokenizer import KeywordMatcher, tokenize
 np.random.seed(0)
 random.seed(0)
 
@@ -30,42 +31,43 @@ domain_knowledge = {
     # Fake news. It’s complicated.
     "fabricat", "manipulat", "imposter", "mislead", "parody",
 }
-masks = {
-    "false", "true", "claim", "stat", "quot",
-    "origin", "story", "article", "rumor", "evidence", "proof"
-}
+selected_cols = ["label", "tokens", "rationale_annotation", 
+                 "linear_signal", "domain_knowledge", "date"]
+split_path = "splits.tsv"  # Sets of fact-checks by URL, "none" if dropped.
+random_split = False  # Split by the legacy random sample instead of hashes of URLs, to reproduce old sets.
+
+
+misinfo_matcher = KeywordMatcher(misinfo)
+info_matcher = KeywordMatcher(info)
+domain_matcher = KeywordMatcher(domain_knowledge)
 
 
 def process_verdict(verdict):
-    for label, words in [("misinfo", misinfo), ("info", info)]:
-        for word in words:
-            if word in verdict:
-                return label
+    for label, matcher in [("misinfo", misinfo_matcher), ("info", info_matcher)]:
+        if matcher.search(verdict):
+            return label
     return np.nan
     
 
 def process_tokens(c):
-    tokens = tokenizer.tokenize(c)
-    tokens = ["<" + t[:-5] + ">" if t.endswith("TOKEN") else t.lower() for t in tokens]
-    if len(tokens) > 1000:
-        tokens = tokens[:500] + ["<MORE>"] + tokens[-500:]
-    for i, t in enumerate(tokens):  # Mask too signaling words.
-        for word in masks:
-            if word in t:
-                tokens[i] = "<MASK>"
+    tokens = tokenize(c)
     return pd.Series([" ".join(tokens), len(tokens)])
 
 
 def process_domain(r):
     tokens = r["tokens"].split(" ")
-    domain = ["0" for t in tokens]
-    for i, t in enumerate(tokens):
-        for word in domain_knowledge:
-            if word in t:
-                domain[i] = "1"
+    domain = ["1" if domain_matcher.search(t) else "0" for t in tokens]
     return " ".join(domain)
 
 
+def hash_split(url):
+    """
+    Assign a fact-check to train/dev/test as 0.8/0.1/0.1 by a deterministic hash of its URL.
+    """
+    fraction = int(hashlib.md5(url.encode("utf-8")).hexdigest()[:8], 16) / 16 ** 8
+    return "train" if fraction < 0.8 else "dev" if fraction < 0.9 else "test"
+
+
 class DataCleaner(object):
     """
     Dataset cleaner for fact-checks.
@@ -79,23 +81,47 @@ class DataCleaner(object):
         self.data_dir = data_dir
         
 
-    def clean(self):
-
-        # Load factchecks.
-        factcheck_path = os.path.join(self.data_dir, "snopes.tsv")
-        factcheck = pd.read_csv(factcheck_path, delimiter="\t")
-        factcheck = factcheck.drop_duplicates()
-
-        # _ = factcheck.groupby("verdict").count()["url"].sort_values(ascending=False).index.tolist()
+    def process(self, factcheck):
+        """
+        Label and tokenize fact-checks, dropping ones without labels.
+        """
 
         # Process verdict.
         factcheck["label"] = factcheck["verdict"].apply(process_verdict)
         factcheck = factcheck.dropna()
+        if factcheck.empty:  # No rows to apply to.
+            return factcheck.reindex(columns=list(factcheck.columns) + ["tokens", "len", "domain_knowledge",
+                                                                        "rationale_annotation", "linear_signal"])
         
         # Process tokens.
         factcheck[["tokens", "len"]] = factcheck["content"].apply(process_tokens)
         factcheck = factcheck.dropna()
         
+        # Process domain knowledge.
+        factcheck["domain_knowledge"] = factcheck.apply(process_domain, axis=1)
+        
+        # Other information.
+        factcheck["rationale_annotation"] = " "
+        factcheck["linear_signal"] = " "
+        return factcheck
+
+
+    def load(self):
+        factcheck_path = os.path.join(self.data_dir, "snopes.tsv")
+        factcheck = pd.read_csv(factcheck_path, delimiter="\t")
+        return factcheck.drop_duplicates()
+
+
+    def clean(self):
+
+        # Load factchecks.
+        factcheck = self.load()
+        urls = factcheck["url"].tolist()
+
+        # _ = factcheck.groupby("verdict").count()["url"].sort_values(ascending=False).index.tolist()
+
+        factcheck = self.process(factcheck)
+        
         # Print symbols.
         tokens = set(" ".join(factcheck["tokens"].tolist()).split(" "))
         symbols = {t for t in tokens if t.startswith("<") and t.endswith(">")}
@@ -109,26 +135,52 @@ class DataCleaner(object):
         for lim in [512, 1024, 2048, 4096]:
             percentage = len(factcheck[factcheck["len"] <= lim]) / len(factcheck)
             print(lim, "\t", percentage)
-            
-        # Process domain knowledge.
-        factcheck["domain_knowledge"] = factcheck.apply(process_domain, axis=1)
-        
-        # Other information.
-        factcheck["rationale_annotation"] = " "
-        factcheck["linear_signal"] = " "
         
         # Split and save.
-        selected_cols = ["label", "tokens", "rationale_annotation", 
-                         "linear_signal", "domain_knowledge", "date"]
-        train = factcheck.sample(frac=0.8)
+        if random_split:
+            train = factcheck.sample(frac=0.8)
+            rest = factcheck.drop(train.index)
+            dev = rest.sample(frac=0.5)
+            test = rest.drop(dev.index)
+        else:
+            sets = factcheck["url"].apply(hash_split)
+            train, dev, test = [factcheck[sets == set_name] for set_name in ["train", "dev", "test"]]
         train[selected_cols].to_csv("train.tsv", sep="\t", index=False)
-        factcheck = factcheck.drop(train.index)
-        dev = factcheck.sample(frac=0.5)
         dev[selected_cols].to_csv("dev.tsv", sep="\t", index=False)
-        test = factcheck.drop(dev.index)
         test[selected_cols].to_csv("test.tsv", sep="\t", index=False)
-        
+
+        # Save sets of URLs, so new fact-checks are appended by refresh.
+        splits = pd.concat([pd.DataFrame({"url": df["url"], "set": set_name})
+                            for set_name, df in [("train", train), ("dev", dev), ("test", test)]])
+        dropped = pd.DataFrame({"url": sorted(set(urls) - set(splits["url"])), "set": "none"})
+        pd.concat([splits, dropped]).to_csv(split_path, sep="\t", index=False)
+
+
+    def refresh(self):
+        """
+        Clean only fact-checks with URLs not in splits.tsv, i.e., new ones,
+        and append them to sets assigned by hashes of their URLs.
+        Outputs:
+            factcheck -- new fact-checks with their sets.
+        """
+        if not os.path.exists(split_path):
+            raise FileNotFoundError(split_path + " not found, clean all fact-checks once first.")
+        known = set(pd.read_csv(split_path, sep="\t")["url"])
+
+        factcheck = self.load()
+        factcheck = factcheck[~factcheck["url"].isin(known)]
+        urls = sorted(set(factcheck["url"]))
+        factcheck = self.process(factcheck)
+        factcheck["set"] = factcheck["url"].apply(hash_split)
+
+        for set_name in ["train", "dev", "test"]:
+            df = factcheck[factcheck["set"] == set_name]
+            df[selected_cols].to_csv(set_name + ".tsv", sep="\t", index=False, header=False, mode="a")
+            print(set_name, "\t", len(df), "new")
+        dropped = pd.DataFrame({"url": sorted(set(urls) - set(factcheck["url"])), "set": "none"})
+        pd.concat([factcheck[["url", "set"]], dropped]).to_csv(split_path, sep="\t", index=False,
+                                                                header=False, mode="a")
+        return factcheck
 
 if __name__ == "__main__":
-    tokenizer = nltk.tokenize.WordPunctTokenizer()
     DataCleaner().clean()
@@ -1,32 +1,123 @@
 #!/usr/local/bin/python3
 
 import requests
-import os, sys, json, time
+import os, sys, json, time, random, threading
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from article_archive import ArticleWriter, ArticleReader
+
+# crawler settings
+concurrency = 8  # max number of requests in flight
+rate_per_host = 4.0  # max number of requests per second to a host
+retries = 5  # max number of retries of a request
+backoff = 1.0  # base seconds of exponential backoff between retries
+timeout = 30  # seconds before a request times out
+retry_status = {429, 500, 502, 503, 504}  # responses worth retrying, others are saved as is
+use_archive = False  # save responses as raw/article-NNNNN files, or to the archive raw/articles if True
+
+# per-host rate limiter
+class hostRateLimiter:
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_time = {}
+        self.lock = threading.Lock()
+
+    # wait for the next slot of a host
+    def wait(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            now = time.time()
+            slot = max(now, self.next_time.get(host, now))
+            self.next_time[host] = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
 
 # snopes crawler
 class snopesCrawler:
-    
+
     # initialization
-    def __init__(self, save_path, *args):
-        self.index = 1
+    def __init__(self, save_path, url_list, concurrency=concurrency, rate_per_host=rate_per_host,
+                 retries=retries, backoff=backoff, timeout=timeout, archive=None):
         self.save_path = save_path
-        self.base = "https://www.snopes.com/fact-check/page/"
-        if args:
-            self.url_list = args[0]
+        self.archive = archive
+        self.url_list = url_list
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.limiter = hostRateLimiter(rate_per_host)
+        self.local = threading.local()
+        self.journal_path = os.path.join(save_path, "crawl_journal")
+        self.lock = threading.Lock()
+
+    # a pooled session per thread, keeping connections alive
+    def session(self):
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=self.concurrency,
+                                                    pool_maxsize=self.concurrency)
+            self.local.session.mount("http://", adapter)
+            self.local.session.mount("https://", adapter)
+        return self.local.session
+
+    # indices of articles saved by previous runs
+    def load_journal(self):
+        if self.archive is not None:  # the archive index is the journal
+            return ArticleReader(self.archive.path).indices()
+        if not os.path.exists(self.journal_path):
+            return set()
+        with open(self.journal_path, "r") as f:
+            done = {int(line) for line in f.read().split("\n") if line.isdigit()}
+        return {index for index in done
+                if os.path.exists(os.path.join(self.save_path, "article-{:05}".format(index)))}
+
+    # save a response atomically and record it in the journal
+    def save(self, index, content):
+        if self.archive is not None:
+            self.archive.put(index, content)
+            return
+        path = os.path.join(self.save_path, "article-{:05}".format(index))
+        with open(path + ".tmp", "wb") as f:
+            f.write(content)
+        os.replace(path + ".tmp", path)
+        with self.lock:
+            with open(self.journal_path, "a") as f:
+                f.write("{}\n".format(index))
 
-    # save current response and increment to next
-    def save_and_increment(self):
-        with open(os.path.join(self.save_path, "article-{:05}".format(self.index)), "w") as f:
-            f.write(self.res.content.decode("utf-8"))
-        self.index += 1
+    # get a response with retries and exponential backoff
+    def get(self, index):
+        url = self.url_list[index - 1]
+        for attempt in range(self.retries + 1):
+            self.limiter.wait(url)
+            try:
+                res = self.session().get(url, timeout=self.timeout)
+                if res.status_code not in retry_status:
+                    self.save(index, res.content)
+                    print(index, res.status_code)
+                    return True
+                retry_after = res.headers.get("Retry-After", "")
+                wait = float(retry_after) if retry_after.isdigit() else 0
+                error = res.status_code
+            except requests.RequestException as e:
+                wait = 0
+                error = type(e).__name__
+            if attempt < self.retries:
+                time.sleep(max(wait, self.backoff * 2 ** attempt * (1 + random.random())))
+        print(index, "failed:", error)
+        return False
 
-    # get a response
-    def get(self):
-        if self.index > len(self.url_list):
-            exit()
-        self.res = requests.get(self.url_list[self.index - 1])
-        print(self.index, self.res.status_code)
-        self.save_and_increment()
+    # crawl all articles not in the journal
+    def crawl(self):
+        done = self.load_journal()
+        todo = [index for index in range(1, len(self.url_list) + 1) if index not in done]
+        print("{} done, {} to crawl".format(len(done), len(todo)))
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            results = list(pool.map(self.get, todo))
+        failed = [index for index, ok in zip(todo, results) if not ok]
+        if failed:  # data_extractor.py stops at the first missing article
+            print("{} failed, run again to resume: {}".format(len(failed), failed[:20]))
+        return failed
 
 
 if __name__ == "__main__":
@@ -34,6 +125,8 @@ if __name__ == "__main__":
     list_path = os.path.join("raw", "url_list")
     with open(list_path, "r") as f:
         url_list = f.read().split("\n")[:-1]
-    snopes = snopesCrawler(save_path, url_list)
-    while True:
-        snopes.get()
+    archive = ArticleWriter(os.path.join(save_path, "articles")) if use_archive else None
+    snopes = snopesCrawler(save_path, url_list, archive=archive)
+    snopes.crawl()
+    if archive is not None:
+        archive.close()
@@ -1,26 +1,82 @@
 #!/usr/local/bin/python3
 
-import os, sys, json, time, re
-from bs4 import BeautifulSoup
+import os, sys, json, time, re, io
+from bs4 import BeautifulSoup, SoupStrainer
 import unicodedata
+import multiprocessing as mp
+from article_archive import ArticleReader
+
+# Extraction settings.
+num_workers = 8  # Number of processes extracting articles, 0 to extract one by one.
+chunk_size = 100  # Number of articles extracted by a process at a time.
+fast_parse = True  # Parse only elements of recent fact-checks, and the full page for legacy formats.
+verify = False  # Check the fast parse against the full page, and keep the full one on mismatches.
+
+# Elements of recent fact-checks, i.e., ld+json scripts, rating spans and bodies.
+def is_needed(name, attrs):
+    props = attrs.get("class") or []
+    if isinstance(props, str):
+        props = props.split()
+    if name == "script":
+        return attrs.get("type") == "application/ld+json"
+    if name == "span":
+        return "h3" in props and len(props) > 1 and "rating-label" in props[1]
+    if name == "div":
+        return "single-body" in props
+    return False
+
+# Strainer keeping only the needed elements while parsing.
+class fastStrainer(SoupStrainer):
+
+    def __init__(self):
+        SoupStrainer.__init__(self, ["script", "span", "div"])
+
+    def allow_tag_creation(self, nsprefix, name, attrs):  # BeautifulSoup 4.13 and later.
+        return is_needed(name, attrs or {})
+
+    def search_tag(self, markup_name=None, markup_attrs={}):  # Earlier versions.
+        return is_needed(markup_name, markup_attrs) or None
 
 # Snopes extractor.
 class snopesExtractor:
 
-    def __init__(self, raw_path, save_path, urls):
+    def __init__(self, raw_path, save_path, urls, resume=False, fast_parse=fast_parse, verify=verify, archive=None,
+                 append=False):
         self.index = 1
         self.raw_path = raw_path
+        self.archive = archive
         self.save_path = save_path
+        self.checkpoint_path = save_path + ".checkpoint"
         self.urls = urls
+        self.fast_parse = fast_parse
+        self.verify = verify
+        self.strainer = fastStrainer()
         self.quotetoken = " QUOTETOKEN "
         self.mediatoken = " MEDIATOKEN "
         self.paratoken = " PARATOKEN "
         self.urltoken = " URLTOKEN "
         self.attoken = " USERTOKEN "
-        self.quotetag = BeautifulSoup("<p>" + self.quotetoken + "</p>", "html.parser")
-        self.mediatag = BeautifulSoup("<p>" + self.mediatoken + "</p>", "html.parser")
-        self.f = open(self.save_path, "w")
-        self.f.write("url\tdate\tverdict\tcontent\n")
+        self.set_tags((False, False))
+        self.tags_used = (False, False)  # Whether the last article used quotetag and mediatag.
+        checkpoint = None
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, "r") as f:
+                checkpoint = json.load(f)
+        if append and not checkpoint and os.path.exists(self.save_path):  # Extracted without a checkpoint.
+            checkpoint = self.rebuild_checkpoint()
+        # Continue from the last checkpoint of an interrupted run, or of any run to append new articles.
+        if checkpoint and ((resume and not checkpoint.get("done")) or append):
+            self.index = checkpoint["index"]
+            self.set_tags(checkpoint["tags_used"])
+            self.f = open(self.save_path, "r+b")
+            self.f.truncate(checkpoint["size"])  # Drop rows written after the checkpoint.
+            self.f.seek(checkpoint["size"])
+            print("Resume from", self.index)
+        else:
+            if checkpoint:  # Stale after starting over.
+                os.remove(self.checkpoint_path)
+            self.f = open(self.save_path, "wb")
+            self.f.write("url\tdate\tverdict\tcontent\n".encode("utf-8"))
     
     # Extract date.
     def extract_date(self, soup):
@@ -35,12 +91,19 @@ class snopesExtractor:
                         return date
         return ""
 
-    # Extract verdict.
-    def extract_verdict(self, soup):
-        for tag in soup.find_all("span"):  # Format for recent fact-checks.
+    # Extract rating of recent fact-checks.
+    def extract_rating(self, soup):
+        for tag in soup.find_all("span"):
             props = tag.get("class")
             if props and "h3" in props and "rating-label" in props[1]:
                 return tag.text
+        return None
+
+    # Extract verdict.
+    def extract_verdict(self, soup):
+        rating = self.extract_rating(soup)  # Format for recent fact-checks.
+        if rating is not None:
+            return rating
         for tag in soup.find_all("div"):  # Format for old fact-checks.
             props = tag.get("class")
             if props and "claim-old" in props:
@@ -64,8 +127,11 @@ class snopesExtractor:
         for tag in soup.find_all("div"):
             props = tag.get("class")
             if props and "single-body" in props:
-                [t.replaceWith(self.quotetag) for t in tag("blockquote")]
-                [t.replaceWith(self.mediatag) for t in tag("iframe")]
+                quotes = tag("blockquote")
+                [t.replaceWith(self.quotetag) for t in quotes]
+                medias = tag("iframe")
+                [t.replaceWith(self.mediatag) for t in medias]
+                self.tags_used = (len(quotes) > 0, len(medias) > 0)
                 [t.decompose() for t in tag("script")]
                 [t.decompose() for t in tag("table")]
                 [t.decompose() for t in tag("dt")]
@@ -91,15 +157,52 @@ class snopesExtractor:
                 return content
         return ""
 
-    # Traverse all raw responses.
-    def traverse(self):
-        file_name = "article-{:05d}".format(self.index)
-        file_path = os.path.join(self.raw_path, file_name)
-        if not os.path.exists(file_path):  # Done, no next one.
-            return False
-        with open(file_path, "r") as f:
-            soup = BeautifulSoup(f, "html.parser")
-            
+    # Make quote and media tags, empty if used.
+    # Tags are moved into the first article using them, so later articles get no tokens.
+    def set_tags(self, tags_used):
+        self.quotetag = BeautifulSoup("" if tags_used[0] else "<p>" + self.quotetoken + "</p>", "html.parser")
+        self.mediatag = BeautifulSoup("" if tags_used[1] else "<p>" + self.mediatoken + "</p>", "html.parser")
+
+    # Parse only the needed elements, or the full page for legacy formats without ratings.
+    def parse(self, html):
+        if self.fast_parse:
+            soup = BeautifulSoup(html, "html.parser", parse_only=self.strainer)
+            if self.extract_rating(soup) is not None:
+                return soup
+        return BeautifulSoup(html, "html.parser")
+
+    # Whether there is an article.
+    def exists(self, index):
+        if self.archive is not None:
+            return index in self.archive
+        return os.path.exists(os.path.join(self.raw_path, "article-{:05d}".format(index)))
+
+    # Read an article as text, the same as from its file.
+    def read(self, index):
+        if self.archive is not None:
+            return io.TextIOWrapper(io.BytesIO(self.archive.get(index))).read()
+        with open(os.path.join(self.raw_path, "article-{:05d}".format(index)), "r") as f:
+            return f.read()
+
+    # Extract a row of an article, "" if verdict or content is not found, None if there is no such article.
+    def extract(self, index):
+        if not self.exists(index):  # Done, no next one.
+            return None
+        html = self.read(index)
+        tags_used = (not self.quotetag.contents, not self.mediatag.contents)
+        row = self.extract_row(index, self.parse(html))
+        if self.fast_parse and self.verify:  # Extract again from the full page with the same tags.
+            fast_row = row
+            self.set_tags(tags_used)
+            row = self.extract_row(index, BeautifulSoup(html, "html.parser"))
+            if row != fast_row:
+                print(index, "\t", "mismatch of fast parse")
+        return row
+
+    # Extract a row from a parsed article.
+    def extract_row(self, index, soup):
+        self.tags_used = (False, False)
+
         # Extract date.
         date = self.extract_date(soup)
         
@@ -108,22 +211,101 @@ class snopesExtractor:
         verdict = re.sub("[^a-z ]+", " ", verdict.lower())
         verdict = re.sub(" +", " ", verdict).strip()
         if not verdict or verdict == " ":  # Verdict not found.
-            self.index += 1
-            return True
+            return ""
 
         # Extract and clean content.
         content = self.extract_content(soup)
         if not content:  # Content not found.
-            self.index += 1
-            return True
+            return ""
 
-        # Write to file.
-        url = self.urls[self.index-1]
-        self.f.write("\t".join([url, date, verdict, content]) + "\n")
-        print(self.index, "\t", date[:10], "\t", verdict)
+        url = self.urls[index-1]
+        return "\t".join([url, date, verdict, content]) + "\n"
+
+    # Write a row to file.
+    def write(self, index, row):
+        self.f.write(row.encode("utf-8"))
+        print(index, "\t", row.split("\t")[1][:10], "\t", row.split("\t")[2])
+
+    # Traverse all raw responses, recording progress every chunk_size articles.
+    def traverse(self):
+        row = self.extract(self.index)
+        if row is None:  # Done, no next one.
+            self.save_checkpoint(done=True)  # The next run starts over, unless appending new articles.
+            return False
+        if row:
+            self.write(self.index, row)
         self.index += 1
+        if self.index % chunk_size == 0:
+            self.save_checkpoint()
         return True
 
+    # Record progress, so an interrupted run can resume.
+    def save_checkpoint(self, done=False):
+        self.f.flush()
+        with open(self.checkpoint_path + ".tmp", "w") as f:
+            json.dump({"index": self.index, "size": self.f.tell(), "done": done,
+                       "tags_used": [not self.quotetag.contents, not self.mediatag.contents]}, f)
+        os.replace(self.checkpoint_path + ".tmp", self.checkpoint_path)
+
+    # Checkpoint of a file extracted without one, e.g., by an earlier version, after its last row.
+    # Articles after the last row are extracted again, which only the ones without rows can be.
+    def rebuild_checkpoint(self):
+        size, last, tags_used = 0, None, [False, False]
+        with open(self.save_path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):  # Partly written.
+                    break
+                size += len(line)
+                last = line
+                tags_used[0] = tags_used[0] or self.quotetoken.strip().encode("utf-8") in line
+                tags_used[1] = tags_used[1] or self.mediatoken.strip().encode("utf-8") in line
+        if last is None:  # Not even a header.
+            raise ValueError("{} is empty, extract without appending.".format(self.save_path))
+        index = 1
+        if size > len(last):  # Not only the header.
+            url = last.decode("utf-8").split("\t")[0]
+            if url not in self.urls:
+                raise ValueError("The last row of {} is not in the URL list: {}".format(self.save_path, url))
+            index = self.urls.index(url) + 2
+        print("Rebuilt the checkpoint of", self.save_path)
+        return {"index": index, "size": size, "done": True, "tags_used": tags_used}
+
+    # Traverse all raw responses with processes, each extracting a chunk of articles.
+    # Rows are written in index order, so the output is the same as the one of traverse.
+    # Workers extract with used tags, and articles using the tags first are extracted again here.
+    def traverse_parallel(self, num_workers, chunk_size):
+        end = self.index
+        while self.exists(end):
+            end += 1
+        chunks = [range(start, min(start + chunk_size, end)) for start in range(self.index, end, chunk_size)]
+        self.f.flush()  # Workers are forked with the file.
+        _worker["extractor"] = self
+        pool = mp.get_context("fork").Pool(num_workers)
+        for chunk, rows in zip(chunks, pool.imap(_extract_chunk, chunks)):
+            for index, (row, tags_used) in zip(chunk, rows):
+                if (tags_used[0] and self.quotetag.contents) or (tags_used[1] and self.mediatag.contents):
+                    row = self.extract(index)
+                if row:
+                    self.write(index, row)
+            self.index = chunk[-1] + 1
+            self.save_checkpoint()
+        pool.close()
+        pool.join()
+        self.save_checkpoint(done=True)  # The next run starts over, unless appending new articles.
+
+
+# Extractor shared with forked workers.
+_worker = {}
+
+
+def _extract_chunk(chunk):
+    extractor = _worker["extractor"]
+    extractor.set_tags((True, True))
+    rows = []
+    for index in chunk:
+        rows.append((extractor.extract(index), extractor.tags_used))
+    return rows
+
 
 if __name__ == "__main__":
     raw_path = "raw"
@@ -131,8 +313,15 @@ if __name__ == "__main__":
     with open(url_path, "r") as f:
         urls = f.read().split("\n")[:-1]
     save_path = os.path.join("raw", "snopes.tsv")
-    snopes = snopesExtractor(raw_path, save_path, urls)
-    flag = True
-    while flag:
-        flag = snopes.traverse()
+    archive_path = os.path.join("raw", "articles")
+    archive = ArticleReader(archive_path) if os.path.exists(archive_path) else None  # Archived by the crawler.
+    if num_workers > 0:
+        snopes = snopesExtractor(raw_path, save_path, urls, resume=True, archive=archive)
+        snopes.traverse_parallel(num_workers, chunk_size)
+    else:
+        snopes = snopesExtractor(raw_path, save_path, urls, resume=True, archive=archive)
+        flag = True
+        while flag:
+            flag = snopes.traverse()
+    snopes.f.close()
         
@@ -0,0 +1,54 @@
+# coding: utf-8
+
+
+import os
+
+import data_downloader, data_extractor
+from article_archive import ArticleWriter, ArticleReader
+from data_cleaner import DataCleaner
+
+
+# Refresh the dataset with new fact-checks, i.e., URLs appended to raw/url_list,
+# processing only new articles at each step.
+raw_path = "raw"
+archive_path = os.path.join(raw_path, "articles")
+with open(os.path.join(raw_path, "url_list"), "r") as f:
+    urls = f.read().split("\n")[:-1]
+
+
+# Crawl new URLs, the ones not saved yet.
+archive = ArticleWriter(archive_path) if data_downloader.use_archive else None
+crawler = data_downloader.snopesCrawler(raw_path, urls, archive=archive)
+crawler.crawl()
+if archive is not None:
+    archive.close()
+
+
+# Extract new articles, appending to raw/snopes.tsv from the last extracted one.
+archive = ArticleReader(archive_path) if data_downloader.use_archive else None  # The layout crawled to.
+extractor = data_extractor.snopesExtractor(raw_path, os.path.join(raw_path, "snopes.tsv"), urls,
+                                           archive=archive, append=True)
+extractor.traverse_parallel(max(data_extractor.num_workers, 1), data_extractor.chunk_size)
+extractor.f.close()
+
+
+# Clean new fact-checks, appending them to sets by hashes of their URLs.
+factcheck = DataCleaner(raw_path).refresh()
+
+
+# Update w2v with new fact-checks.
+if os.path.exists("w2v.model") and len(factcheck):
+    from gensim.models import Word2Vec
+    import data_word2vec
+    corpus = [t.split(" ") for t in factcheck["tokens"].tolist()]
+    model = Word2Vec.load("w2v.model")
+    model.workers = data_word2vec.num_workers or data_word2vec.available_cores()
+    model.build_vocab(corpus, update=True)
+    data_word2vec.train(model, corpus, len(corpus))
+    data_word2vec.save_vectors(model)
+    model.save("w2v.model")
+
+
+# Binary caches of sets are updated with appended rows when loaded,
+# e.g., by python run.py --mode=refresh in rationalize.
+print("Refreshed with {} new fact-checks.".format(len(factcheck)))
@@ -0,0 +1,89 @@
+# coding: utf-8
+
+
+import nltk
+
+
+masks = {
+    "false", "true", "claim", "stat", "quot",
+    "origin", "story", "article", "rumor", "evidence", "proof"
+}
+word_tokenizer = nltk.tokenize.WordPunctTokenizer()
+
+
+class KeywordMatcher(object):
+    """
+    Aho–Corasick automaton telling if a text contains any of the keywords as a substring,
+    memoized per text since token types are far fewer than tokens.
+    """
+
+    def __init__(self, keywords, memo_size=None):
+        """
+        Inputs:
+            keywords -- substrings to search for.
+            memo_size -- max number of texts memoized, cleared once full, None for no limit, 0 for no memo.
+        """
+        self.goto = [{}]  # Transitions of nodes.
+        self.fail = [0]  # Failure links of nodes.
+        self.out = [False]  # If a keyword ends at a node or its failure links.
+        for keyword in keywords:
+            node = 0
+            for c in keyword:
+                if c not in self.goto[node]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(False)
+                    self.goto[node][c] = len(self.goto) - 1
+                node = self.goto[node][c]
+            self.out[node] = True
+
+        # Link nodes to their longest proper suffixes in breadth-first order.
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for c, child in self.goto[node].items():
+                fail = self.fail[node]
+                while fail and c not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail][c] if c in self.goto[fail] else 0
+                self.out[child] = self.out[child] or self.out[self.fail[child]]
+                queue.append(child)
+        self.memo_size = memo_size
+        self.memo = {}
+
+
+    def search(self, text):
+        if text in self.memo:
+            return self.memo[text]
+        found = self.out[0]  # An empty keyword is in any text.
+        node = 0
+        for c in text:
+            if found:
+                break
+            while node and c not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(c, 0)
+            found = self.out[node]
+        if self.memo_size is None or len(self.memo) < self.memo_size:
+            self.memo[text] = found
+        elif self.memo_size > 0:  # Full, start over.
+            self.memo = {text: found}
+        return found
+
+
+mask_matcher = KeywordMatcher(masks)
+
+
+def tokenize(c, matcher=mask_matcher):
+    """
+    Tokenize a fact-check, masking too signaling words, without side effects to import it, e.g., by the server.
+    Inputs:
+        c -- the content.
+        matcher -- the KeywordMatcher of words to mask.
+    Outputs:
+        tokens -- a list of tokens.
+    """
+    tokens = word_tokenizer.tokenize(c)
+    tokens = ["<" + t[:-5] + ">" if t.endswith("TOKEN") else t.lower() for t in tokens]
+    if len(tokens) > 1000:
+        tokens = tokens[:500] + ["<MORE>"] + tokens[-500:]
+    return ["<MASK>" if matcher.search(t) else t for t in tokens]  # Mask too signaling words.
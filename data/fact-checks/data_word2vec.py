@@ -2,24 +2,72 @@
 
 
 from gensim.models import Word2Vec
-import os, json, random
+import os, json, time, random
 import pandas as pd
 import numpy as np
 np.random.seed(0)
 random.seed(0)
 
 
-# Read data.
-corpus = []
-for set_name in ["train", "dev", "test"]:
-    df = pd.read_csv(set_name + ".tsv", sep="\t")
-    df["tokens"] = df["tokens"].apply(lambda t: t.split(" "))
-    corpus.extend(df["tokens"].tolist())
+set_names = ["train", "dev", "test"]
+num_workers = 0  # Number of training threads, 0 for all available cores.
+chunk_size = 10000  # Number of rows read at a time.
 
 
-# Train w2v.
-model = Word2Vec(corpus, vector_size=200, window=5, min_count=1, workers=5)
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
 
 
-# Save w2v.
-model.wv.save_word2vec_format("w2v.txt", write_header=False)
+class SetCorpus(object):
+    """
+    Tokens of rows of sets, read a chunk at a time, iterable again for each pass of word2vec.
+    """
+
+    def __init__(self, paths):
+        self.paths = paths
+
+
+    def __iter__(self):
+        for path in self.paths:
+            for df in pd.read_csv(path, sep="\t", usecols=["tokens"], chunksize=chunk_size):
+                for t in df["tokens"].tolist():
+                    yield t.split(" ")
+
+
+def train(model, corpus, total_examples):
+    """
+    Train word2vec on a corpus, printing the throughput.
+    """
+    start = time.time()
+    trained_words, raw_words = model.train(corpus, total_examples=total_examples, epochs=model.epochs)
+    seconds = time.time() - start
+    print("Trained on {} words ({} effective) in {:.1f}s, {:.0f} words/s with {} workers.".format(
+        raw_words, trained_words, seconds, raw_words / max(seconds, 1e-9), model.workers))
+
+
+def save_vectors(model, path="w2v"):
+    """
+    Save word vectors as text, path.txt, and as a binary copy to memory-map,
+    path.npy and path.vocab.json, the same vectors in the same order.
+    """
+    model.wv.save_word2vec_format(path + ".txt", write_header=False)
+    np.save(path + ".npy", model.wv.vectors.astype(np.float32))
+    with open(path + ".vocab.json", "w") as f:
+        json.dump(list(model.wv.index_to_key), f, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+
+    # Read data.
+    corpus = SetCorpus([set_name + ".tsv" for set_name in set_names])
+
+    # Train w2v.
+    model = Word2Vec(vector_size=200, window=5, min_count=1, workers=num_workers or available_cores())
+    model.build_vocab(corpus)
+    train(model, corpus, model.corpus_count)
+
+    # Save w2v, and the model to update with new fact-checks by data_refresher.py.
+    save_vectors(model)
+    model.save("w2v.model")
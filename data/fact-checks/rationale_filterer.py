@@ -1,10 +1,9 @@
 # coding: utf-8
 
 
-import os, json
+import os, re, json
 import pandas as pd
 import numpy as np
-from scipy.spatial.distance import cosine
 
 
 rationale_path = os.path.join("soft_rationalizer_w_domain.vector", "rationale_embeddings.csv")
@@ -39,56 +38,98 @@ class RationaleFilter(object):
     """
 
     def __init__(self, rationale_path):
-        self.df= pd.read_csv(rationale_path)
-        self.df = self.df.dropna()
-        self.df["embeddings"] = self.df["embeddings"].apply(
-            lambda e: [float(_) for _ in e.split(" ")]
-        )
+        self.df = pd.read_csv(rationale_path)
+        embeddings = np.load(rationale_path.replace(".csv", ".npy"))  # Aligned with rows.
+        valid = self.df.notna().all(axis=1).values & ~np.isnan(embeddings).any(axis=1)
+        self.df = self.df[valid].copy()
         self.df["rlen"] = self.df["rationale"].apply(
             lambda r: len(r.split(" "))
         )
-        self.df = self.df[self.df["rlen"] <= 5]
+        short = (self.df["rlen"] <= 5).values
+        self.df = self.df[short]
+        self.embeddings = embeddings[valid][short]  # Aligned with rows of self.df.
         self.misinfo = misinfo
         self.misinfo_embeddings = {}
         self.s = 0.3  # Similarity threshold.
         
+
+    def _contains(self, words):
+        """
+        Substring containment of words in rationales, shape (rationale_num, word_num).
+        """
+        contains = np.zeros((len(self.df), len(words)), dtype=bool)
+        for j, word in enumerate(words):
+            contains[:, j] = self.df["rationale"].str.contains(word, regex=False).values
+        return contains
+
     
-    def _get_misinfo_embeddings(self, r):
-        for word in self.misinfo:
-            if word in r["rationale"]:
-                self.misinfo_embeddings[word] = r["embeddings"]
-                self.misinfo -= {word}
+    def _get_misinfo_embeddings(self):
+        """
+        Take the embeddings of the first rationale containing each root word, one root word
+        per rationale, the first of the set in iteration order.
+        """
+        words = list(self.misinfo)
+        rows = dict(zip(words, [np.flatnonzero(c) for c in self._contains(words).T]))
+        last = -1
+        while True:
+
+            # The next rationale containing any remaining root word.
+            nexts = {}
+            for word in self.misinfo:
+                i = np.searchsorted(rows[word], last, side="right")
+                if i < len(rows[word]):
+                    nexts[word] = rows[word][i]
+            if not nexts:
                 break
+            last = min(nexts.values())
+            word = [word for word in self.misinfo if nexts.get(word) == last][0]
+            self.misinfo_embeddings[word] = self.embeddings[last]
+            self.misinfo -= {word}
 
     
-    def _filter_row(self, r):
-        r["contain"] = False
-        r["similar"] = False
-        for word, word_e in self.misinfo_embeddings.items():
-            if word in r["rationale"]:
-                r["contain"] = True
-                r["embeddings"] = [0.3*x+0.7*y for x, y in zip(r["embeddings"], word_e)]
-                break
-            if cosine(r["embeddings"], word_e) < self.s:
-                r["similar"] = True
-                break
-        r["keep"] = r["contain"] or r["similar"]
-        for word in excludes:
-            if word in r["rationale"]:
-                r["keep"] = False
-                break
-        return r
+    def _filter(self):
+        """
+        Keep rationales containing a root word (blended with its embeddings)
+        or similar to one, decided by the first such root word, and without excluded words.
+        """
+        words = list(self.misinfo_embeddings)
+        X = self.embeddings
+        W = np.array([self.misinfo_embeddings[word] for word in words]).reshape(len(words), X.shape[1])
+
+        # Cosine distances of rationales to root words, the same as scipy's cosine().
+        with np.errstate(divide="ignore", invalid="ignore"):
+            uv = X.dot(W.T)
+            uu_vv = np.outer((X * X).sum(axis=1), (W * W).sum(axis=1))
+            distances = 1.0 - uv / np.sqrt(uu_vv)
+
+        contains = self._contains(words)
+        hits = contains | (distances < self.s)
+        first = np.argmax(hits, axis=1)
+        hit = hits.any(axis=1)
+        contain = hit & contains[np.arange(len(X)), first]
+        similar = hit & ~contain
+
+        X = X.copy()
+        X[contain] = 0.3 * X[contain] + 0.7 * W[first[contain]]
+
+        excluded = self.df["rationale"].str.contains("|".join(re.escape(word) for word in excludes)).values
+        self.df["contain"] = contain
+        self.df["similar"] = similar
+        self.df["keep"] = (contain | similar) & ~excluded
+        self.embeddings = X
     
     
     def rfilter(self):
-        self.df.apply(self._get_misinfo_embeddings, axis=1)
+        self._get_misinfo_embeddings()
         print("Root words:", len(self.misinfo_embeddings))
-        self.df = self.df.apply(self._filter_row, axis=1)
-        self.filtered = self.df[self.df["keep"]]
-        self.filtered["embeddings"] = self.filtered["embeddings"].apply(
-            lambda e: " ".join([str(_) for _ in e])
-        )
+        self._filter()
+        keep = self.df["keep"].values
+        self.filtered = self.df[keep]
         print(self.filtered)
+        np.save(
+            rationale_path.replace(".csv", "_filtered.npy"),
+            self.embeddings[keep]
+        )
         self.filtered.to_csv(
             rationale_path.replace(".csv", "_filtered.csv"),
             index=False
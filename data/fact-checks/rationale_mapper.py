@@ -5,6 +5,8 @@ import os, json
 import pandas as pd
 import numpy as np
 
+from corpus_index import load_index
+
 
 def get_cluster_name(cluster):
     top2 = []
@@ -18,13 +20,6 @@ def get_cluster_name(cluster):
     return ", ".join(top2) + ", etc."
 
 
-def map_rationales(t, d):
-    for rationale in d:
-        if rationale in t:
-            return True
-    return False
-
-
 # Read rationale clusters.
 clusters_path = os.path.join("soft_rationalizer_w_domain.cluster",
                              "misinfo", "clusters.json")
@@ -39,6 +34,7 @@ for set_name in ["train", "dev", "test"]:
     dfs.append(df)
 df = pd.concat(dfs)
 col_old = df.columns
+index = load_index()  # Documents in the same order.
 
 
 # Label event.
@@ -49,7 +45,7 @@ events = {
     "COVID-19": {"covid", "coronavirus"},
 }
 for event_name, event in events.items():
-    df[event_name] = df["tokens"].apply(lambda t: map_rationales(t, event))
+    df[event_name] = index.contains(event)
     print(event_name, "\t", len(df[df[event_name]]))
 
 
@@ -57,7 +53,7 @@ for event_name, event in events.items():
 for cluster in clusters:
     cluster = json.loads(cluster)
     cluster_name = get_cluster_name(cluster)
-    df[cluster_name] = df["tokens"].apply(lambda t: map_rationales(t, cluster))
+    df[cluster_name] = index.contains(cluster)
     print(cluster_name, "\t", len(df[df[cluster_name]]))
 
 
@@ -0,0 +1,106 @@
+# coding: utf-8
+
+
+import os, time, shutil, tempfile, threading, unittest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import data_downloader
+from article_archive import ArticleWriter, ArticleReader
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Serve /N as article N, failing with 503 the first `flaky` requests of each article,
+    and always for articles in `broken`.
+    """
+
+    def do_GET(self):
+        index = int(self.path.strip("/"))
+        with self.server.lock:
+            self.server.hits[index] = self.server.hits.get(index, 0) + 1
+            hits = self.server.hits[index]
+        if index in self.server.broken or hits <= self.server.flaky:
+            self.send_response(503)
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+            return
+        body = "<html>article {}</html>".format(index).encode("utf-8")
+        self.send_response(404 if index in self.server.missing else 200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestCrawler(unittest.TestCase):
+    """
+    Crawl a local stub server, so retries, resuming and both layouts are tested without the network.
+    """
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        self.server.lock = threading.Lock()
+        self.server.hits = {}
+        self.server.flaky = 1
+        self.server.broken = set()
+        self.server.missing = {7}
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.urls = ["http://127.0.0.1:{}/{}".format(self.server.server_port, index) for index in range(1, 21)]
+        self.save_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.save_path)
+
+    def crawler(self, archive=None):
+        return data_downloader.snopesCrawler(self.save_path, self.urls, concurrency=4, rate_per_host=1000,
+                                             retries=2, backoff=0.01, timeout=5, archive=archive)
+
+    def read(self, index):
+        with open(os.path.join(self.save_path, "article-{:05}".format(index)), "rb") as f:
+            return f.read()
+
+    def test_retry(self):
+        self.assertEqual(self.crawler().crawl(), [])
+        self.assertEqual(self.read(3), b"<html>article 3</html>")
+        self.assertEqual(self.read(7), b"<html>article 7</html>")  # Saved as is, not retried.
+        self.assertEqual(self.server.hits[3], 2)
+
+    def test_resume(self):
+        self.server.broken = {5, 6}
+        self.assertEqual(self.crawler().crawl(), [5, 6])
+        self.assertFalse(os.path.exists(os.path.join(self.save_path, "article-00005")))
+        self.server.broken = set()
+        hits = dict(self.server.hits)
+        self.assertEqual(self.crawler().crawl(), [])
+        self.assertEqual(self.read(5), b"<html>article 5</html>")
+        self.assertEqual({index for index in self.server.hits if self.server.hits[index] > hits[index]}, {5, 6})
+
+    def test_archive(self):
+        archive_path = os.path.join(self.save_path, "articles")
+        self.server.broken = {5}
+        archive = ArticleWriter(archive_path)
+        self.assertEqual(self.crawler(archive).crawl(), [5])
+        archive.close()
+        self.server.broken = set()
+        archive = ArticleWriter(archive_path)
+        self.assertEqual(self.crawler(archive).crawl(), [])
+        archive.close()
+        reader = ArticleReader(archive_path)
+        self.assertEqual(reader.indices(), set(range(1, 21)))
+        self.assertEqual(reader.get(5), b"<html>article 5</html>")
+        self.assertEqual([name for name in os.listdir(self.save_path) if name.startswith("article-")], [])
+
+    def test_rate_limit(self):
+        limiter = data_downloader.hostRateLimiter(50)
+        start = time.time()
+        for _ in range(6):
+            limiter.wait(self.urls[0])
+        self.assertGreaterEqual(time.time() - start, 5 / 50 - 0.01)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+# coding: utf-8
+
+
+import os, io, shutil, tempfile, unittest, contextlib
+from unittest import mock
+
+import data_extractor
+
+
+# Saved articles of recent and legacy formats, with and without verdicts and content, quotes and media.
+article_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_articles")
+
+
+class TestExtractor(unittest.TestCase):
+    """
+    Extract the saved articles one by one, in parallel, with and without the fast parse, and across resumes,
+    all of which should give the rows of extracting the full pages one by one.
+    """
+
+    def setUp(self):
+        self.data_path = tempfile.mkdtemp()
+        self.save_path = os.path.join(self.data_path, "snopes.tsv")
+        with open(os.path.join(article_path, "url_list"), "r") as f:
+            self.urls = f.read().split("\n")[:-1]
+        self.expected = self.extract(fast_parse=False)
+        os.remove(self.save_path + ".checkpoint")
+
+
+    def tearDown(self):
+        shutil.rmtree(self.data_path)
+
+
+    def extract(self, raw_path=article_path, num_workers=0, chunk_size=2, stop=None, **kwargs):
+        """
+        Extract articles as data_extractor.py does, interrupted after stop articles if set.
+        Outputs:
+            rows -- the extracted file.
+        """
+        with mock.patch.object(data_extractor, "chunk_size", chunk_size), \
+             contextlib.redirect_stdout(io.StringIO()) as self.log:
+            snopes = data_extractor.snopesExtractor(raw_path, self.save_path, self.urls, **kwargs)
+            if num_workers > 0:
+                snopes.traverse_parallel(num_workers, chunk_size)
+            else:
+                for _ in range(stop or len(self.urls) + 1):
+                    if not snopes.traverse():
+                        break
+            if stop:  # Killed while writing a row, longer than the rows written after resuming.
+                snopes.f.write(("partly written row " * 100).encode("utf-8"))
+            snopes.f.close()
+        with open(self.save_path, "r") as f:
+            return f.read()
+
+
+    def test_expected(self):
+        rows = self.expected.split("\n")[1:-1]
+        self.assertEqual([row.split("\t")[0].split("/")[-2] for row in rows],
+                         ["article-1", "article-3", "article-4", "article-5",
+                          "article-6", "article-7", "article-9", "article-10"])
+        self.assertEqual([row.split("\t")[2] for row in rows],
+                         ["false", "miscaptioned", "status mostly false", "mixture",
+                          "undetermined", "legend", "true", "mostly true"])
+        # Tokens only in the first articles using quotes and media.
+        self.assertEqual([row.count("QUOTETOKEN") for row in rows], [0, 1, 0, 0, 0, 0, 0, 0])
+        self.assertEqual([row.count("MEDIATOKEN") for row in rows], [0, 0, 0, 1, 0, 0, 0, 0])
+
+
+    def test_fast_parse(self):
+        self.assertEqual(self.extract(fast_parse=True), self.expected)
+        self.assertEqual(self.extract(fast_parse=True, verify=True), self.expected)
+        self.assertNotIn("mismatch", self.log.getvalue())
+
+
+    def test_parallel(self):
+        for fast_parse in [False, True]:
+            for num_workers, chunk_size in [(1, 1), (2, 2), (2, 3), (3, 20)]:
+                self.assertEqual(self.extract(num_workers=num_workers, chunk_size=chunk_size, fast_parse=fast_parse),
+                                 self.expected, (fast_parse, num_workers, chunk_size))
+
+
+    def test_resume(self):
+        # Stopped before, between and after the first quote and media.
+        for fast_parse in [False, True]:
+            for stop in [1, 3, 4, 6, 9]:
+                for num_workers in [0, 2]:
+                    self.extract(stop=stop, fast_parse=fast_parse)
+                    self.assertEqual(self.extract(num_workers=num_workers, resume=True, fast_parse=fast_parse),
+                                     self.expected, (fast_parse, stop, num_workers))
+
+
+    def test_append(self):
+        # Extract articles crawled so far, then append the rest, with and without a checkpoint.
+        raw_path = os.path.join(self.data_path, "raw")
+        for fast_parse in [False, True]:
+            for crawled in [2, 4, 5, 8]:
+                for num_workers in [0, 2]:
+                    for checkpoint in [True, False]:
+                        shutil.rmtree(raw_path, ignore_errors=True)
+                        os.makedirs(raw_path)
+                        for index in range(1, crawled + 1):
+                            name = "article-{:05d}".format(index)
+                            shutil.copy(os.path.join(article_path, name), raw_path)
+                        self.extract(raw_path, num_workers=num_workers, fast_parse=fast_parse)
+                        if not checkpoint:
+                            os.remove(self.save_path + ".checkpoint")
+                        for index in range(crawled + 1, len(self.urls) + 1):
+                            name = "article-{:05d}".format(index)
+                            shutil.copy(os.path.join(article_path, name), raw_path)
+                        self.assertEqual(self.extract(raw_path, num_workers=num_workers, append=True,
+                                                      fast_parse=fast_parse),
+                                         self.expected, (fast_parse, crawled, num_workers, checkpoint))
+
+
+if __name__ == "__main__":
+    unittest.main()
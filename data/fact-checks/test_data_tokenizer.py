@@ -0,0 +1,116 @@
+# coding: utf-8
+
+
+import random, unittest
+import numpy as np
+
+from data_tokenizer import masks, word_tokenizer, KeywordMatcher, tokenize
+from data_cleaner import misinfo, info, domain_knowledge, process_verdict
+
+
+# Tokens and verdicts hitting keywords at the start, middle and end, overlapping keywords,
+# e.g., "stat" in "statement" and "false" and "fals", and near misses.
+tokens = [
+    "", "a", "true", "untrue", "truely", "tru", "rue", "false", "falsely", "fals", "fal",
+    "statement", "states", "sta", "quote", "quotation", "misquoted", "original", "origin", "orig",
+    "history", "stories", "story", "articles", "rumors", "rumour", "evidenced", "proofs", "proo",
+    "claimed", "clai", "unproven", "proven", "outdated", "legendary", "satire", "satirical", "scammer",
+    "miscaptioned", "misattributed", "fabricated", "manipulation", "imposters", "misleading", "parody",
+    "fiction", "fictitious", "superstitious", "hoaxes", "fraudulent", "incorrectly", "inaccurately",
+    "mixture", "incomplete", "partly", "probably", "maybe", "undetermined", "unconfirmed",
+    "real", "really", "correct", "accurate", "was true", "true but", "not quite", "sort of",
+    "sort", "not likely", "in progress", "no longer", "not any", "mostly true", "mostly false",
+    "<URL>", "<MASK>", "ststat", "trtrue", "fafalse", "quotquot", "misattributmisattribut",
+]
+
+
+def naive_search(keywords, text):
+    """
+    The original rule, if any keyword is a substring of the text.
+    """
+    for keyword in keywords:
+        if keyword in text:
+            return True
+    return False
+
+
+def naive_tokenize(c):
+    """
+    Tokens of the original process_tokens().
+    """
+    tokens = word_tokenizer.tokenize(c)
+    tokens = ["<" + t[:-5] + ">" if t.endswith("TOKEN") else t.lower() for t in tokens]
+    if len(tokens) > 1000:
+        tokens = tokens[:500] + ["<MORE>"] + tokens[-500:]
+    for i, t in enumerate(tokens):
+        for word in masks:
+            if word in t:
+                tokens[i] = "<MASK>"
+    return tokens
+
+
+def naive_verdict(verdict):
+    """
+    Label of the original process_verdict().
+    """
+    for label, words in [("misinfo", misinfo), ("info", info)]:
+        for word in words:
+            if word in verdict:
+                return label
+    return np.nan
+
+
+class TestKeywordMatcher(unittest.TestCase):
+    """
+    KeywordMatcher and tokenize() against the naive substring rules they replace.
+    """
+
+    def assertSearches(self, keywords, texts):
+        for memo_size in [None, 0, 3]:
+            matcher = KeywordMatcher(keywords, memo_size)
+            for _ in range(2):  # Twice, to search memoized texts too.
+                for text in texts:
+                    self.assertEqual(matcher.search(text), naive_search(keywords, text),
+                                     (sorted(keywords), memo_size, text))
+
+
+    def test_keywords(self):
+        for keywords in [masks, domain_knowledge, misinfo, info, misinfo | info]:
+            self.assertSearches(keywords, tokens)
+
+
+    def test_overlapping(self):
+        # Keywords which are prefixes, suffixes and substrings of each other, to follow failure links.
+        texts = ["ushers", "she", "hers", "his", "hi", "h", "abcx", "abcd", "aabcd", "bcbcd", "xabcabcd"]
+        self.assertSearches({"he", "she", "his", "hers"}, texts)
+        self.assertSearches({"ab", "bc", "abcd", "cd", "bcx"}, texts)
+        self.assertSearches({"abcd", "bcx"}, texts)
+        self.assertSearches({""}, texts + [""])
+        self.assertSearches(set(), texts + [""])
+
+
+    def test_random(self):
+        # Random keywords and texts of a small alphabet, to overlap a lot.
+        rng = random.Random(0)
+        for _ in range(200):
+            keywords = {"".join(rng.choice("abc") for _ in range(rng.randint(1, 4)))
+                        for _ in range(rng.randint(1, 6))}
+            texts = ["".join(rng.choice("abc") for _ in range(rng.randint(0, 10))) for _ in range(20)]
+            self.assertSearches(keywords, texts)
+
+
+    def test_tokenize(self):
+        content = " ".join(tokens) + " The CLAIM's origin: URLTOKEN said \"quoted\" STATS, it's true-ish."
+        self.assertEqual(tokenize(content), naive_tokenize(content))
+        long_content = " ".join(random.Random(0).choice(tokens) for _ in range(1500))
+        self.assertEqual(tokenize(long_content), naive_tokenize(long_content))
+        self.assertIn("<MORE>", tokenize(long_content))
+
+
+    def test_verdict(self):
+        for verdict in tokens:
+            self.assertEqual(str(process_verdict(verdict)), str(naive_verdict(verdict)), verdict)
+
+
+if __name__ == "__main__":
+    unittest.main()
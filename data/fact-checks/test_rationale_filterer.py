@@ -0,0 +1,127 @@
+# coding: utf-8
+
+
+import os, math, shutil, tempfile, unittest, warnings
+import numpy as np
+import pandas as pd
+from scipy.spatial.distance import cosine
+
+from rationale_filterer import RationaleFilter, excludes
+
+
+def filter_rows(rationales, embeddings, words, s):
+    """
+    The original row-wise filter with scipy's cosine(), the reference.
+    Outputs:
+        misinfo_embeddings -- embeddings of root words in the order they are found.
+        rows -- contain, similar, keep and embeddings of each rationale.
+    """
+    misinfo, misinfo_embeddings = set(words), {}
+    for r, e in zip(rationales, embeddings):
+        for word in misinfo:
+            if word in r:
+                misinfo_embeddings[word] = e
+                misinfo -= {word}
+                break
+
+    rows = []
+    for r, e in zip(rationales, embeddings):
+        contain, similar = False, False
+        for word, word_e in misinfo_embeddings.items():
+            if word in r:
+                contain = True
+                e = [0.3*x+0.7*y for x, y in zip(e, word_e)]
+                break
+            if cosine(e, word_e) < s:
+                similar = True
+                break
+        keep = contain or similar
+        for word in excludes:
+            if word in r:
+                keep = False
+                break
+        rows.append((contain, similar, keep, list(e)))
+    return misinfo_embeddings, rows
+
+
+class TestRationaleFilter(unittest.TestCase):
+    """
+    Filter seeded random rationales and embeddings, with zero vectors and distances tied with the threshold,
+    against the original row-wise filter.
+    """
+
+    def setUp(self):
+        self.data_path = tempfile.mkdtemp()
+        self.rationale_path = os.path.join(self.data_path, "rationale_embeddings.csv")
+        # Root words overlapping each other and excluded words, e.g., "fals" and "falsi".
+        self.words = ["fals", "hoax", "jok", "error", "satir", "mislead", "misled", "bias", "flaw", "legend"]
+        self.vocab = ["false", "falsified", "hoax", "joke", "jokes", "errors", "satire", "misleading", "misled",
+                      "biased", "flawed", "legendary", "the", "claim", "photo", "video", "report", "website", "old"]
+
+
+    def tearDown(self):
+        shutil.rmtree(self.data_path)
+
+
+    def save(self, embeddings, seed):
+        """
+        Save rationales of 1 to 7 words, a few missing, with the embeddings and a few nan rows.
+        """
+        rng = np.random.RandomState(seed)
+        rationales = [" ".join(rng.choice(self.vocab, size=rng.randint(1, 8))) for _ in range(len(embeddings))]
+        for i in rng.choice(len(embeddings), size=3, replace=False):
+            rationales[i] = np.nan
+        for i in rng.choice(len(embeddings), size=3, replace=False):
+            embeddings[i] = np.nan
+        pd.DataFrame({"count": rng.randint(1, 100, size=len(embeddings)), "label": "misinfo",
+                      "rationale": rationales}).to_csv(self.rationale_path, index=False)
+        np.save(self.rationale_path.replace(".csv", ".npy"), embeddings)
+
+
+    def assertFiltered(self, s=0.3):
+        # The original dropped rows with missing rationales or embeddings, and rationales of over 5 words.
+        df = pd.read_csv(self.rationale_path)
+        embeddings = np.load(self.rationale_path.replace(".csv", ".npy"))
+        rows = [(r, e.tolist()) for r, e in zip(df["rationale"], embeddings)
+                if r == r and not np.isnan(e).any() and len(r.split(" ")) <= 5]
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)  # Zero vectors.
+            misinfo_embeddings, expected = filter_rows([r for r, _ in rows], [e for _, e in rows], self.words, s)
+
+        rfilter = RationaleFilter(self.rationale_path)
+        rfilter.misinfo = set(self.words)
+        rfilter.s = s
+        rfilter._get_misinfo_embeddings()
+        rfilter._filter()
+
+        self.assertEqual(rfilter.df["rationale"].tolist(), [r for r, _ in rows])
+        self.assertEqual(list(rfilter.misinfo_embeddings), list(misinfo_embeddings))
+        for word, e in misinfo_embeddings.items():
+            self.assertEqual(rfilter.misinfo_embeddings[word].tolist(), e)
+        for column, i in [("contain", 0), ("similar", 1), ("keep", 2)]:
+            self.assertEqual(rfilter.df[column].tolist(), [row[i] for row in expected], column)
+        self.assertEqual(rfilter.embeddings.tolist(), [row[3] for row in expected])
+        return expected
+
+
+    def test_random(self):
+        for seed in range(5):
+            embeddings = np.random.RandomState(seed).randn(200, 8)
+            embeddings[::17] = 0  # Zero vectors, of nan distances.
+            self.save(embeddings, seed)
+            expected = self.assertFiltered()
+            self.assertTrue(any(row[0] for row in expected) and any(row[1] for row in expected))
+
+
+    def test_ties(self):
+        # Small integers, so distances are exact and many are tied, with thresholds of tied distances.
+        embeddings = np.random.RandomState(0).randint(-1, 2, size=(300, 3)).astype(np.float64)
+        self.save(embeddings, 0)
+        for u, v in [([1, 0, 0], [1, 1, 0]), ([1, 1, 0], [1, 1, 1]), ([1, 0, 0], [0, 1, 0])]:
+            s = 1.0 - np.dot(u, v) / math.sqrt(np.dot(u, u) * np.dot(v, v))
+            expected = self.assertFiltered(s)
+            self.assertTrue(any(row[1] for row in expected))
+
+
+if __name__ == "__main__":
+    unittest.main()
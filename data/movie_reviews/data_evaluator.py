@@ -6,6 +6,8 @@ import numpy as np
 import pandas as pd
 from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score
 
+from data_signaler import split_set_path, load_signals
+
 
 def get_metrics(row, pred_col, true_col="rationale_annotation", average="binary"):
     row["a"] = accuracy_score(row[true_col], row[pred_col])
@@ -43,8 +45,14 @@ class DataEvaluator(object):
     
     def evaluate(self, data_dir):
         df = pd.read_csv(data_dir, sep="\t")
-        df["linear_signal"] = df["linear_signal"].apply(lambda s: [int(float(_) >= 0.0711) for _ in s.split()])
-        df["domain_knowledge"] = df["domain_knowledge"].apply(lambda d: [int(_) for _ in d.split()])
+        signals = load_signals(*split_set_path(data_dir), ["linear_signal", "domain_knowledge"])
+        if len(signals) == 2:  # Binary signals saved by data_signaler.py.
+            signals = {column: np.split(values, offsets[1:-1]) for column, (values, offsets) in signals.items()}
+            df["linear_signal"] = [(s >= 0.0711).astype(int).tolist() for s in signals["linear_signal"]]
+            df["domain_knowledge"] = [d.astype(int).tolist() for d in signals["domain_knowledge"]]
+        else:
+            df["linear_signal"] = df["linear_signal"].apply(lambda s: [int(float(_) >= 0.0711) for _ in s.split()])
+            df["domain_knowledge"] = df["domain_knowledge"].apply(lambda d: [int(_) for _ in d.split()])
         df["domain_knowledge_abs"] = df["domain_knowledge"].apply(lambda d: [abs(_) for _ in d])
         df["rationale_annotation"] = df["rationale_annotation"].apply(lambda r: [int(_) for _ in r.split()])
 
@@ -0,0 +1,133 @@
+# coding: utf-8
+
+
+import os, sys, json, shutil, tempfile, unittest, importlib.util
+from unittest import mock
+import numpy as np
+import pandas as pd
+
+
+# Loaded by path, as personal_attacks has a data_signaler.py too.
+spec = importlib.util.spec_from_file_location(
+    "movie_reviews_data_signaler", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data_signaler.py"))
+data_signaler = importlib.util.module_from_spec(spec)
+sys.modules[spec.name] = data_signaler  # For processes to pickle its functions.
+spec.loader.exec_module(data_signaler)
+
+
+class FakeLemmatizer(object):
+    """
+    Strip a suffix by part of speech, so tests do not need WordNet data.
+    """
+    suffixes = {"n": "s", "v": "ing", "a": "er"}
+
+    def lemmatize(self, word, pos="n"):
+        suffix = self.suffixes[pos]
+        return word[:-len(suffix)] if word.endswith(suffix) and len(word) > len(suffix) + 1 else word
+
+
+def signal_rows(signaler, df, wnl):
+    """
+    Signals of the original row-wise signaler, as the reference.
+    """
+
+    def _get_signal(row):
+        signal_dict = signaler.signal_dicts[row["label"]]
+        tokens = row["tokens"].split(" ")
+        signal = ["{:.5f}".format(signal_dict[t])
+                  if t in signal_dict else "0.0" for t in tokens]
+        return " ".join(signal)
+
+    def _get_domain(row):
+        tokens = row["tokens"].split(" ")
+        tokens = [wnl.lemmatize(token, "n") for token in tokens]
+        tokens = [wnl.lemmatize(token, "v") for token in tokens]
+        tokens = [wnl.lemmatize(token, "a") for token in tokens]
+        domain = ["1" if t in signaler.domain_dicts["positive"] else
+                  ("-1" if t in signaler.domain_dicts["negative"] else "0")
+                  for t in tokens]
+        return " ".join(domain)
+
+    df = df.copy()
+    df["linear_signal"] = df.apply(_get_signal, axis=1)
+    df["domain_knowledge"] = df.apply(_get_domain, axis=1)
+    return df
+
+
+class TestSignaler(unittest.TestCase):
+    """
+    Signal a small set with word weights rounding to zero, missing words and lemmas in the lexicon.
+    """
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.data_path = tempfile.mkdtemp()
+        os.chdir(self.data_path)
+        os.makedirs("linear_bow.analyze")
+        weights = {"fuck": (-1.5, 1.5), "good": (0.123456, -0.123456), "bad": (-0.654321, 0.654321),
+                   "tiny": (0.000001, -0.000002), "plot": (0.02, 0.0)}
+        with open(os.path.join("linear_bow.analyze", "word_weight.json"), "w") as f:
+            for word, (positive, negative) in weights.items():
+                f.write(json.dumps({"word": word, "positive": positive, "negative": negative}) + "\n")
+        lexicon_path = os.path.join("raw", "NRC-Emotion-Lexicon", "NRC-Emotion-Lexicon-v0.92")
+        os.makedirs(lexicon_path)
+        with open(os.path.join(lexicon_path, "NRC-Emotion-Lexicon-Wordlevel-v0.92.txt"), "w") as f:
+            f.write("good\tpositive\t1\ngood\tjoy\t1\nbad\tnegative\t1\nbad\tpositive\t0\n"
+                    "sad\tnegative\t1\nlove\tpositive\t1\n")
+        rng = np.random.RandomState(0)
+        vocab = list(weights) + ["goods", "badder", "loving", "sads", "movie", "the", "a", "unseen"]
+        rows = [{"label": ["positive", "negative"][i % 2],
+                 "tokens": " ".join(rng.choice(vocab, size=rng.randint(1, 12))),
+                 "rationale_annotation": " ", "linear_signal": " ", "domain_knowledge": " "}
+                for i in range(40)]
+        pd.DataFrame(rows).to_csv("train.tsv", sep="\t", index=False)
+
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.data_path)
+
+
+    def signal(self, **settings):
+        """
+        Signal train.tsv, exporting text, and get the reference signals of its rows.
+        """
+        with mock.patch.object(data_signaler, "wnl", FakeLemmatizer()), \
+             mock.patch.multiple(data_signaler, export_text=True, **settings):
+            signaler = data_signaler.DataSignaler()
+            expected = signal_rows(signaler, pd.read_csv("train.tsv", sep="\t"), data_signaler.wnl)
+            signaler.signal("train.tsv")
+        return expected
+
+
+    def test_export_text(self):
+        expected = self.signal(num_workers=0)
+        with open("train.tsv", "r") as f:
+            self.assertEqual(f.read(), expected.to_csv(sep="\t", index=False))
+        self.assertIn("0.0 ", " ".join(expected["linear_signal"]) + " ")  # Missing words.
+        self.assertIn("0.00000", " ".join(expected["linear_signal"]))  # Weights rounding to zero.
+
+        # Binary signals are the values of the text.
+        signals = data_signaler.load_signals("", "train", ["linear_signal", "domain_knowledge"])
+        for column in ["linear_signal", "domain_knowledge"]:
+            values = [float(_) for text in expected[column] for _ in text.split(" ")]
+            self.assertEqual(signals[column][0].tolist(), values)
+
+
+    def test_pooled(self):
+        # Types lemmatized in this process, and in chunks by processes, against the row-wise signals, by column.
+        for settings in [{"num_workers": 0, "chunk_size": 3}, {"num_workers": 2, "chunk_size": 3},
+                         {"num_workers": 2, "chunk_size": 1000}]:
+            expected = self.signal(**settings)
+            signaled = pd.read_csv("train.tsv", sep="\t", dtype=str, keep_default_na=False)
+            self.assertEqual(list(signaled.columns), list(expected.columns))
+            for column in expected.columns:
+                self.assertEqual(signaled[column].tolist(), expected[column].astype(str).tolist(), (column, settings))
+            signals = data_signaler.load_signals("", "train", ["linear_signal", "domain_knowledge"])
+            for column in ["linear_signal", "domain_knowledge"]:
+                values = [float(_) for text in expected[column] for _ in text.split(" ")]
+                self.assertEqual(signals[column][0].tolist(), values, (column, settings))
+
+
+if __name__ == "__main__":
+    unittest.main()
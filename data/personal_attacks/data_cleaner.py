@@ -1,46 +1,89 @@
 # coding: utf-8
 
 
-import os, json
+import os, ast, json
+import multiprocessing as mp
+from collections import deque
 import pandas as pd
 import numpy as np
 import nltk
 
 
-def process_comment(row):
+num_workers = 8  # Number of processes cleaning comments, 0 to clean in this process.
+chunk_size = 10000  # Number of comments cleaned by a process at a time.
+annotation_chunk_size = 1000000  # Number of annotations averaged at a time.
+process_cols = ["comment", "rationale", "split_x", "split_y"]
+selected_cols = ["label", "tokens", "rationale_annotation", "linear_signal", "domain_knowledge"]
+
+tokenizer = nltk.tokenize.WordPunctTokenizer()
+
+
+def parse_rationale(r):
+    """
+    Parse a rationale list, e.g., "[0, 1, 1]", into its concatenated elements, "011".
+    """
+    try:
+        values = json.loads(r)
+    except ValueError:  # Not JSON, e.g., with Python literals.
+        values = ast.literal_eval(r)
+    return "".join(str(_) for _ in values)
+
+
+def process_comment(comment, rationale):
+    """
+    Tokenize a comment, trimming its rationale of a character per token the same way.
+    Outputs:
+        tokens, rationale -- space separated, rationale is NaN if missing, or None, None if invalid.
+    """
 
     # This two lines can NOT be changed as comments align with rationales.
-    tokens = row["comment"].replace("TAB_TOKEN", "\t").replace("NEWLINE_TOKEN", "\n").lower().strip()
+    tokens = comment.replace("TAB_TOKEN", "\t").replace("NEWLINE_TOKEN", "\n").lower().strip()
     tokens = tokenizer.tokenize(tokens)
 
     # Invalid.
     if len(tokens) < 2:
-            return np.nan
+            return None, None
 
     # Remove leading "`,:".
-    while "`" in tokens[0] or "," in tokens[0] or ":" in tokens[0]:
-        if len(tokens) < 2:  # Invalid.
-            return np.nan
-        tokens = tokens[1:]
-        if row["rationale"] == row["rationale"]:  # If not NaN.
-            row["rationale"] = row["rationale"][1:]
+    start = 0
+    while "`" in tokens[start] or "," in tokens[start] or ":" in tokens[start]:
+        if len(tokens) - start < 2:  # Invalid.
+            return None, None
+        start += 1
+    tokens = tokens[start:]
+    if rationale == rationale:  # If not NaN.
+        rationale = rationale[start:]
 
     # Remove trailing "`".
     if tokens[-1] == "`":
         tokens = tokens[:-1]
-        if row["rationale"] == row["rationale"]:  # If not NaN.
-            row["rationale"] = row["rationale"][:-1]
+        if rationale == rationale:  # If not NaN.
+            rationale = rationale[:-1]
 
     # Validity checks.
-    if row["rationale"] == row["rationale"]:  # If not NaN.
-        assert len(tokens) == len(row["rationale"])
-        row["rationale"] = " ".join(row["rationale"])
-    if row["split_y"] == row["split_y"]:  # If not NaN.
-        assert row["split_x"] == row["split_y"]
-    
-    row["tokens"] = " ".join(tokens)
+    if rationale == rationale:  # If not NaN.
+        assert len(tokens) == len(rationale)
+        rationale = " ".join(rationale)
 
-    return row
+    return " ".join(tokens), rationale
+
+
+def _clean_chunk(chunk):
+    """
+    Clean a chunk of merged comments.
+    Outputs:
+        tokens, rationale -- lists of process_comment outputs.
+    """
+    tokens, rationale = [], []
+    for c, r in zip(chunk["comment"].tolist(), chunk["rationale"].tolist()):
+        t, r = process_comment(c, r)
+        tokens.append(t)
+        rationale.append(r)
+
+    # Validity checks.
+    checked = chunk["split_y"].notna().values & np.array([t is not None for t in tokens], dtype=bool)
+    assert (chunk["split_x"][checked] == chunk["split_y"][checked]).all()
+    return tokens, rationale
 
 
 class DataCleaner(object):
@@ -57,20 +100,27 @@ class DataCleaner(object):
         self.data_dir = data_dir
         self.score_threshold = score_threshold
         self.label_vocab = {}
-        
 
-    def clean(self):
 
-        # Load sentence.
-        sentence_path = os.path.join(self.data_dir, "attack_annotated_comments.tsv")
-        sentence = pd.read_csv(sentence_path, delimiter="\t")
-
-        # Load label.
+    def load_label(self):
+        """
+        Mean attack score of each comment, summing annotations a chunk at a time.
+        """
         label_path = os.path.join(self.data_dir, "attack_annotations.tsv")
-        label = pd.read_csv(label_path, delimiter="\t")
-        label = label.groupby("rev_id").mean()
-
-        # Load rationale.
+        total, count = None, None
+        for chunk in pd.read_csv(label_path, delimiter="\t", usecols=["rev_id", "attack"],
+                                 chunksize=annotation_chunk_size):
+            grouped = chunk.groupby("rev_id")["attack"]
+            if total is None:
+                total, count = grouped.sum(), grouped.count()
+            else:
+                total = total.add(grouped.sum(), fill_value=0)
+                count = count.add(grouped.count(), fill_value=0)
+        label = (total / count.where(count > 0)).rename("attack").to_frame()
+        return label
+
+
+    def load_rationale(self):
         rationale_dev_path = os.path.join(self.data_dir, "wiki_attack_dev_rationale.csv")
         rationale_dev = pd.read_csv(rationale_dev_path)
         rationale_dev["split"] = "dev"
@@ -79,26 +129,64 @@ class DataCleaner(object):
         rationale_test["split"] = "test"
         rationale = pd.concat([rationale_dev, rationale_test])
         rationale["rev_id"] = rationale["platform_comment_id"]
-        rationale["rationale"] = rationale["rationale"].apply(lambda r: "".join(str(_) for _ in eval(r)))
-        
-        # Merge sentence and label.
-        df = sentence.merge(label, on="rev_id", how="inner").merge(rationale, on="rev_id", how="left")
-        df = df.apply(process_comment, axis=1)
+        rationale["rationale"] = rationale["rationale"].apply(parse_rationale)
+        return rationale
+
+
+    def _read_chunks(self, label, rationale):
+        """
+        Chunks of comments merged with their label and rationale.
+        """
+        sentence_path = os.path.join(self.data_dir, "attack_annotated_comments.tsv")
+        for sentence in pd.read_csv(sentence_path, delimiter="\t", chunksize=chunk_size):
+            yield sentence.merge(label, on="rev_id", how="inner").merge(rationale, on="rev_id", how="left")
+
+
+    def _save_chunk(self, df, result, files):
+        df = df.assign(tokens=result[0], rationale=result[1])
         df = df.dropna(subset={"tokens"})
         df["split_y"] = df["split_y"].fillna("train")
         df["label"] = df["attack"].apply(lambda a: "attack" if a >= self.score_threshold else "not_attack")
-        df = df.fillna(" ")
-        df["rationale_annotation"] = df["rationale"]
+        df["rationale_annotation"] = df["rationale"].fillna(" ")
         df["linear_signal"] = " "
         df["domain_knowledge"] = " "
+        for split, f in files.items():
+            df[df["split_y"] == split][selected_cols].to_csv(f, index=False, header=False, sep="\t")
+
+
+    def clean(self):
+        """
+        Clean comments in chunks, with num_workers processes if any, appending them to the sets in order.
+        Only a bounded number of chunks is in memory at a time.
+        """
 
-        # Save data.
-        selected_cols = ["label", "tokens", "rationale_annotation", "linear_signal", "domain_knowledge"]
-        for split in ["train", "dev", "test"]:
-            data = df[df["split_y"] == split][selected_cols]
-            data.to_csv(split + ".tsv", index=False, sep="\t")
+        # Load label and rationale.
+        label = self.load_label()
+        rationale = self.load_rationale()
+
+        # Merge sentence, label and rationale, and clean them a chunk at a time.
+        files = {split: open(split + ".tsv", "w") for split in ["train", "dev", "test"]}
+        for f in files.values():
+            pd.DataFrame(columns=selected_cols).to_csv(f, index=False, sep="\t")
+        if num_workers > 0:
+            pool = mp.get_context("fork").Pool(num_workers)
+            pending = deque()
+            for chunk in self._read_chunks(label, rationale):
+                pending.append((chunk, pool.apply_async(_clean_chunk, (chunk[process_cols],))))
+                if len(pending) >= 2 * num_workers:
+                    chunk, result = pending.popleft()
+                    self._save_chunk(chunk, result.get(), files)
+            while pending:
+                chunk, result = pending.popleft()
+                self._save_chunk(chunk, result.get(), files)
+            pool.close()
+            pool.join()
+        else:
+            for chunk in self._read_chunks(label, rationale):
+                self._save_chunk(chunk, _clean_chunk(chunk), files)
+        for f in files.values():
+            f.close()
 
 
 if __name__ == "__main__":
-    tokenizer = nltk.tokenize.WordPunctTokenizer()
     DataCleaner().clean()
@@ -1,26 +1,65 @@
 # coding: utf-8
 
 
-import os, json
+import os, sys, json
+import multiprocessing as mp
+import numpy as np
 import pandas as pd
 from nltk.stem.wordnet import WordNetLemmatizer
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "rationalize"))
+from utils.signal_store import split_set_path, save_signals, load_signals
+
+
+num_workers = 8  # Number of processes lemmatizing tokens, 0 to lemmatize in this process.
+chunk_size = 10000  # Number of distinct tokens lemmatized by a process at a time.
+export_text = False  # Also write signals as text to the columns of [SET].tsv.
+
+wnl = WordNetLemmatizer()
+
+
+def _lemmatize(tokens):
+    tokens = [wnl.lemmatize(token, "n") for token in tokens] # lemmatization nouns.
+    tokens = [wnl.lemmatize(token, "v") for token in tokens] # lemmatization verbs.
+    tokens = [wnl.lemmatize(token, "a") for token in tokens] # lemmatization adjectives.
+    return tokens
+
+
+def lemmatize(tokens):
+    """
+    Lemmatize tokens as nouns, verbs and adjectives in turn, in chunks with num_workers processes.
+    """
+    chunks = [tokens[i: i + chunk_size] for i in range(0, len(tokens), chunk_size)]
+    if num_workers > 0 and len(chunks) > 1:
+        wnl.lemmatize("signal")  # Load WordNet once, shared with forked processes.
+        with mp.get_context("fork").Pool(num_workers) as pool:
+            return [token for chunk in pool.imap(_lemmatize, chunks) for token in chunk]
+    return _lemmatize(tokens)
+
 
 class DataSignaler(object):
     """
     Dataset signaler for personal attacks.
-    Add linear signal and domain knowledge to train.tsv, dev.tsv and test.tsv.
+    Add linear signal and domain knowledge of tokens of train.tsv, dev.tsv and test.tsv to their binary caches.
     """
 
     def __init__(self):
         self.data_dirs = ["train.tsv", "dev.tsv", "test.tsv"]
         
-        # Linear signal
-        self.vocab_dir = os.path.join("linear_bow.analyze", "word_weight.json")
-        vocab = pd.read_json(self.vocab_dir, lines=True)
+        # Linear signal, word weights exported by --mode=analyze, or as JSON lines.
+        self.vocab_dir = os.path.join("linear_bow.analyze", "word_weight.npz")
         self.signal_dicts = {}
-        for l in set(vocab.columns) - {"word"}:
-            self.signal_dicts[l] = {w: s for w, s in vocab[["word", l]].values}
+        if os.path.exists(self.vocab_dir):
+            with np.load(self.vocab_dir) as f:
+                words, labels, weight = f["word"].tolist(), f["label"].tolist(), f["weight"]
+            for j, l in enumerate(labels):
+                self.signal_dicts[l] = dict(zip(words, weight[:, j].tolist()))
+        else:
+            self.vocab_dir = os.path.join("linear_bow.analyze", "word_weight.json")
+            vocab = pd.read_json(self.vocab_dir, lines=True)
+            for l in set(vocab.columns) - {"word"}:
+                self.signal_dicts[l] = {w: s for w, s in vocab[["word", l]].values}
+        for l in self.signal_dicts:
             print(l, "fuck", self.signal_dicts[l]["fuck"])
         signal_sorted = sorted(self.signal_dicts[l].items(), key=lambda _: abs(_[1]))
         threshold = signal_sorted[int(len(signal_sorted) * -0.05):]
@@ -33,32 +72,59 @@ class DataSignaler(object):
         self.domain_set = {_.split("\t")[0].split("_")[0] for _ in vocab if _.split("\t")[1] == "true"}
     
 
-    def _get_signal(self, row):
-        signal_dict = self.signal_dicts[row["label"]]
-        tokens = row["tokens"].split(" ")
-        signal = ["{:.5f}".format(signal_dict[t])
-                  if t in signal_dict else "0.0" for t in tokens]
-        return " ".join(signal)
+    def _get_types(self, df):
+        """
+        Distinct tokens of all documents, and ids of tokens of each document in them.
+        """
+        type2id = {}
+        ids = [np.array([type2id.setdefault(t, len(type2id)) for t in tokens.split(" ")], dtype=np.int64)
+               for tokens in df["tokens"]]
+        return list(type2id), ids
+
+
+    def _get_signal(self, types):
+        """
+        Linear signal of each distinct token by label, rounded to 5 decimals.
+        """
+        return {l: np.array([round(signal_dict.get(t, 0.), 5) for t in types], dtype=np.float64)
+                for l, signal_dict in self.signal_dicts.items()}
+
+
+    def _get_signal_text(self, types):
+        """
+        Linear signal of each distinct token by label as text, "0.0" if the token has no weight.
+        """
+        return {l: np.array(["{:.5f}".format(signal_dict[t]) if t in signal_dict else "0.0" for t in types],
+                            dtype=object)
+                for l, signal_dict in self.signal_dicts.items()}
 
     
-    def _get_domain(self, row):
-        tokens = row["tokens"].split(" ")
-        tokens = [wnl.lemmatize(token, "n") for token in tokens] # lemmatization nouns.
-        tokens = [wnl.lemmatize(token, "v") for token in tokens] # lemmatization verbs.
-        tokens = [wnl.lemmatize(token, "a") for token in tokens] # lemmatization adjectives.
-        domain = ["1" if t in self.domain_set else "0" for t in tokens]
-        return " ".join(domain)
+    def _get_domain(self, types):
+        """
+        Domain knowledge of each distinct token, looked up by its lemma.
+        """
+        domain = [1 if t in self.domain_set else 0 for t in lemmatize(types)]
+        return np.array(domain, dtype=np.int8)
 
     
     def signal(self, data_dir):
         df = pd.read_csv(data_dir, sep="\t")
-        df["linear_signal"] = df.apply(self._get_signal, axis=1)
-        df["domain_knowledge"] = df.apply(self._get_domain, axis=1)
-        df.to_csv(data_dir, index=False, sep="\t")
+        types, ids = self._get_types(df)
+        signal = self._get_signal(types)
+        domain = self._get_domain(types)
+
+        # Signals of tokens, gathered from the values of distinct tokens by token ids.
+        signals = {"linear_signal": [signal[l][i] for l, i in zip(df["label"], ids)],
+                   "domain_knowledge": [domain[i] for i in ids]}
+        if export_text:  # Before saving signals, which are valid for the set as written.
+            signal_text = self._get_signal_text(types)
+            df["linear_signal"] = [" ".join(signal_text[l][i]) for l, i in zip(df["label"], ids)]
+            df["domain_knowledge"] = [" ".join(d.astype(str)) for d in signals["domain_knowledge"]]
+            df.to_csv(data_dir, index=False, sep="\t")
+        save_signals(*split_set_path(data_dir), signals)
 
 
 if __name__ == "__main__":
-    wnl = WordNetLemmatizer()
     signaler = DataSignaler()
     signaler.signal(signaler.data_dirs[0])
     signaler.signal(signaler.data_dirs[1])
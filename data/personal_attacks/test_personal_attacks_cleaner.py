@@ -0,0 +1,187 @@
+# coding: utf-8
+
+
+import os, sys, random, shutil, tempfile, unittest, importlib.util
+from unittest import mock
+import numpy as np
+import pandas as pd
+
+
+# Loaded by path, as fact-checks has a data_cleaner.py too.
+spec = importlib.util.spec_from_file_location(
+    "personal_attacks_data_cleaner", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data_cleaner.py"))
+data_cleaner = importlib.util.module_from_spec(spec)
+sys.modules[spec.name] = data_cleaner  # For processes to pickle its functions.
+spec.loader.exec_module(data_cleaner)
+
+
+def process_row(row):
+    """
+    The original row-wise process_comment, the reference.
+    """
+
+    # This two lines can NOT be changed as comments align with rationales.
+    tokens = row["comment"].replace("TAB_TOKEN", "\t").replace("NEWLINE_TOKEN", "\n").lower().strip()
+    tokens = data_cleaner.tokenizer.tokenize(tokens)
+
+    # Invalid.
+    if len(tokens) < 2:
+            return np.nan
+
+    # Remove leading "`,:".
+    while "`" in tokens[0] or "," in tokens[0] or ":" in tokens[0]:
+        if len(tokens) < 2:  # Invalid.
+            return np.nan
+        tokens = tokens[1:]
+        if row["rationale"] == row["rationale"]:  # If not NaN.
+            row["rationale"] = row["rationale"][1:]
+
+    # Remove trailing "`".
+    if tokens[-1] == "`":
+        tokens = tokens[:-1]
+        if row["rationale"] == row["rationale"]:  # If not NaN.
+            row["rationale"] = row["rationale"][:-1]
+
+    # Validity checks.
+    if row["rationale"] == row["rationale"]:  # If not NaN.
+        assert len(tokens) == len(row["rationale"])
+        row["rationale"] = " ".join(row["rationale"])
+    if row["split_y"] == row["split_y"]:  # If not NaN.
+        assert row["split_x"] == row["split_y"]
+
+    row["tokens"] = " ".join(tokens)
+
+    return row
+
+
+def clean_sets(data_dir, score_threshold=0.5):
+    """
+    Sets of the original cleaner, loading and cleaning all comments at once, the reference.
+    Outputs:
+        sets -- {split: text of split.tsv}.
+    """
+    sentence = pd.read_csv(os.path.join(data_dir, "attack_annotated_comments.tsv"), delimiter="\t")
+    label = pd.read_csv(os.path.join(data_dir, "attack_annotations.tsv"), delimiter="\t")
+    label = label.groupby("rev_id").mean()
+    rationale_dev = pd.read_csv(os.path.join(data_dir, "wiki_attack_dev_rationale.csv"))
+    rationale_dev["split"] = "dev"
+    rationale_test = pd.read_csv(os.path.join(data_dir, "wiki_attack_test_rationale.csv"))
+    rationale_test["split"] = "test"
+    rationale = pd.concat([rationale_dev, rationale_test])
+    rationale["rev_id"] = rationale["platform_comment_id"]
+    rationale["rationale"] = rationale["rationale"].apply(lambda r: "".join(str(_) for _ in eval(r)))
+
+    df = sentence.merge(label, on="rev_id", how="inner").merge(rationale, on="rev_id", how="left")
+    df = df.apply(process_row, axis=1)
+    df = df.dropna(subset={"tokens"})
+    df["split_y"] = df["split_y"].fillna("train")
+    df["label"] = df["attack"].apply(lambda a: "attack" if a >= score_threshold else "not_attack")
+    df = df.fillna(" ")
+    df["rationale_annotation"] = df["rationale"]
+    df["linear_signal"] = " "
+    df["domain_knowledge"] = " "
+
+    selected_cols = ["label", "tokens", "rationale_annotation", "linear_signal", "domain_knowledge"]
+    return {split: df[df["split_y"] == split][selected_cols].to_csv(index=False, sep="\t")
+            for split in ["train", "dev", "test"]}
+
+
+class TestCleaner(unittest.TestCase):
+    """
+    Clean a small dataset with leading and trailing marks, invalid comments, comments without labels,
+    and rationales of JSON and Python literals, against the original cleaner.
+    """
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.data_path = tempfile.mkdtemp()
+        os.chdir(self.data_path)
+        os.makedirs("raw")
+        rng = random.Random(0)
+        words = ["you", "are", "an", "idiot", "`", "``", ",", ":", "hello", "wiki", "page", "'s",
+                 "\"quoted\"", "NEWLINE_TOKEN", "TAB_TOKEN", "..."]
+        comments, annotations, rationales = [], [], {"dev": [], "test": []}
+        for i in range(120):
+            rev_id = 1000 + i * 7
+            comment = " ".join(rng.choice(words) for _ in range(rng.choice([1, 2, 3, 8, 20])))
+            if rng.random() < 0.3:
+                comment = "``:, " + comment
+            if rng.random() < 0.3:
+                comment = comment + " `"
+            split = rng.choice(["train", "train", "dev", "test"])
+            comments.append({"rev_id": rev_id, "comment": comment, "year": 2010, "logged_in": True,
+                             "ns": "user", "sample": "random", "split": split})
+            if i % 10 != 9:  # Others are not annotated.
+                for worker_id in range(rng.randint(1, 4)):
+                    annotations.append({"rev_id": rev_id, "worker_id": worker_id, "attack": float(rng.randint(0, 1))})
+            if split != "train" and rng.random() < 0.6:
+                tokens = data_cleaner.tokenizer.tokenize(
+                    comment.replace("TAB_TOKEN", "\t").replace("NEWLINE_TOKEN", "\n").lower().strip())
+                values = [rng.randint(0, 1) for _ in tokens]
+                literal = rng.choice(["[{}]", "[{}]", "({},)", "[{},]"] if values else ["[{}]"])  # Python too.
+                rationale = literal.format(", ".join(str(_) for _ in values))
+                rationales[split].append({"platform_comment_id": rev_id, "rationale": rationale.replace(" ", "")
+                                          if rng.random() < 0.3 else rationale, "text": comment[:10]})
+        pd.DataFrame(comments).to_csv(os.path.join("raw", "attack_annotated_comments.tsv"), sep="\t", index=False)
+        pd.DataFrame(annotations).to_csv(os.path.join("raw", "attack_annotations.tsv"), sep="\t", index=False)
+        for split, rows in rationales.items():
+            pd.DataFrame(rows).to_csv(os.path.join("raw", "wiki_attack_%s_rationale.csv" % split), index=False)
+
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.data_path)
+
+
+    def test_parse_rationale(self):
+        # JSON lists, and Python literals parsed by the ast fallback.
+        for r in ["[0, 1, 1]", "[0,1,1]", "[]", "[1]", "[0.0, 1.0]",
+                  "[True, False]", "(0, 1, 1)", "(1,)", "[0, 1, 1,]", "['0', '1']"]:
+            self.assertEqual(data_cleaner.parse_rationale(r), "".join(str(_) for _ in eval(r)), r)
+
+
+    def test_clean_chunk(self):
+        cleaner = data_cleaner.DataCleaner()
+        label, rationale = cleaner.load_label(), cleaner.load_rationale()
+        with mock.patch.object(data_cleaner, "chunk_size", 25):
+            chunks = list(cleaner._read_chunks(label, rationale))
+        self.assertGreater(len(chunks), 1)
+        invalid, annotated = 0, []
+        for chunk in chunks:
+            tokens, rationales = data_cleaner._clean_chunk(chunk[data_cleaner.process_cols])
+            for (index, row), t, r in zip(chunk.iterrows(), tokens, rationales):
+                expected = process_row(row.copy())
+                if not isinstance(expected, pd.Series):  # Invalid.
+                    self.assertIsNone(t)
+                    invalid += 1
+                    continue
+                self.assertEqual(t, expected["tokens"])
+                if expected["rationale"] == expected["rationale"]:
+                    self.assertEqual(r, expected["rationale"])
+                    annotated.append((chunk, index))
+                else:  # Missing.
+                    self.assertNotEqual(r, r)
+        self.assertGreater(invalid, 0)
+        self.assertGreater(len(annotated), 0)
+
+        # Sets of comments and rationales are checked too.
+        chunk, index = annotated[0]
+        chunk = chunk[data_cleaner.process_cols].copy()
+        chunk.loc[index, "split_x"] = "train"
+        with self.assertRaises(AssertionError):
+            data_cleaner._clean_chunk(chunk)
+
+
+    def test_clean(self):
+        expected = clean_sets("raw")
+        for settings in [{"num_workers": 0}, {"num_workers": 0, "chunk_size": 7, "annotation_chunk_size": 10},
+                         {"num_workers": 2, "chunk_size": 7}, {"num_workers": 3, "chunk_size": 1000}]:
+            with mock.patch.multiple(data_cleaner, **settings):
+                data_cleaner.DataCleaner().clean()
+            for split in ["train", "dev", "test"]:
+                with open(split + ".tsv", "r") as f:
+                    self.assertEqual(f.read(), expected[split], (split, settings))
+
+
+if __name__ == "__main__":
+    unittest.main()
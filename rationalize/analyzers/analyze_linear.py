@@ -3,24 +3,35 @@
 
 import torch
 import os, json
+import numpy as np
 
 
 def analyze(ckpt_path, out_path, data, args):
+    """
+    Export word weights of a linear model to word_weight.npz, with
+        word -- words in id order, shape (vocab_size,).
+        label -- labels in id order, shape (label_num,).
+        weight -- weights of words for labels, shape (vocab_size, label_num).
+    and to word_weight.json, a JSON object per word, if args.weight_jsonl.
+    """
 
     model = torch.load(ckpt_path)  # Load model from checkpoint.    
-    weight = model.linear.weight  # Weights of words.
+    weight = model.linear.weight.detach().cpu().numpy().T  # Weights of words, shape (vocab_size, label_num).
 
     if not os.path.exists(out_path):
         os.mkdir(out_path)
-    f = open(os.path.join(out_path, "word_weight.json"), "w")
-
-    for wid in range(len(weight[0])):  # Word id.
-        word = data.idx2word[wid]  # Word.
-        words_js = {"word": word}  # Output for a word.
-        for label_id in data.idx2label:
-            label = data.idx2label[label_id]  # Label.
-            word_w = weight[label_id][wid].item()  # Word weight.
-            words_js[label] = word_w
-        f.write(json.dumps(words_js) + "\n")
-
-    f.close()
+
+    # Export all weights at once, with words and labels in id order.
+    words = [data.idx2word[wid] for wid in range(len(weight))]
+    label_ids = list(data.idx2label)
+    labels = [data.idx2label[label_id] for label_id in label_ids]
+    weight = weight[:, label_ids]
+    np.savez(os.path.join(out_path, "word_weight.npz"), word=np.array(words), label=np.array(labels), weight=weight)
+
+    # A JSON object per word, optionally.
+    if getattr(args, "weight_jsonl", 0):
+        with open(os.path.join(out_path, "word_weight.json"), "w") as f:
+            for word, word_w in zip(words, weight.astype(np.float64).tolist()):
+                words_js = {"word": word}  # Output for a word.
+                words_js.update(zip(labels, word_w))
+                f.write(json.dumps(words_js) + "\n")
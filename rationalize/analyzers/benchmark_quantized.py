@@ -0,0 +1,78 @@
+# coding: utf-8
+
+
+import torch
+from torch.autograd import Variable
+
+import os, json, time
+import numpy as np
+
+from utils.quantizer import load_model
+
+
+def _infer(model, data, args, set_name):
+    """
+    Run a model over a set on CPU.
+    Outputs:
+        y_pred -- predicted labels, shape (instance_count,).
+        z -- rationales of all instances without <PAD>, shape (token_count,).
+        seconds -- time spent on forwarding the model.
+    """
+
+    model.eval()  # Set model to eval mode.
+    y_pred, z_all = [], []
+    seconds = 0.
+
+    instance_count = data.data_sets[set_name].size()
+    for start in range(instance_count // args.batch_size + 1):
+
+        # Get a batch.
+        batch_idx = range(start * args.batch_size,
+                          min((start + 1) * args.batch_size, instance_count))
+        if not batch_idx:
+            continue
+        x, y, m, r, s, d = data.get_batch(set_name, batch_idx=batch_idx, sort=True)
+        x = Variable(torch.from_numpy(x))
+        m = Variable(torch.from_numpy(m)).float()
+
+        # Get predictions and rationales.
+        begin = time.time()
+        with torch.no_grad():
+            predict, _, z, _, _ = model(x, m)
+        seconds += time.time() - begin
+
+        y_pred.extend(torch.max(predict, dim=1)[1].tolist())
+        z_all.append(z[m > 0].numpy())
+
+    return np.array(y_pred), np.concatenate(z_all), seconds
+
+
+def benchmark(ckpt_path, bench_path, data, args):
+    """
+    Compare int8 dynamic quantized inference with float32 inference on CPU.
+    Reports speedup, agreement of predicted labels and drift of rationales z.
+    """
+
+    models = {"float32": load_model(ckpt_path, cpu=True),
+              "int8": load_model(ckpt_path, quantized=True)}
+
+    if not os.path.exists(bench_path):
+        os.mkdir(bench_path)
+
+    report = {}
+    for set_name in ["dev", "test"]:
+        outputs = {k: _infer(model, data, args, set_name) for k, model in models.items()}
+        (y_f, z_f, t_f), (y_q, z_q, t_q) = outputs["float32"], outputs["int8"]
+        report[set_name] = {
+            "float32_seconds": t_f,
+            "int8_seconds": t_q,
+            "speedup": t_f / t_q,
+            "label_agreement": float(np.mean(y_f == y_q)),
+            "z_pearson": float(np.corrcoef(z_f, z_q)[0, 1]),
+            "z_mean_abs_diff": float(np.mean(np.abs(z_f - z_q))),
+            "z_max_abs_diff": float(np.max(np.abs(z_f - z_q))),
+        }
+        print(set_name, report[set_name])
+
+    with open(os.path.join(bench_path, "report.json"), "w") as f:
+        f.write(json.dumps(report, indent=4))
@@ -1,41 +1,117 @@
 # coding: utf-8
 
 
-import os
+import os, json, warnings
 import numpy as np
 import pandas as pd
 
-from runners.metrics import precision, recall, f1, accuracy, percentage
-metric_funcs = {"precision": precision, "percentage": percentage}
+from utils.rationale_store import RationaleReader
 
 
-def _thresholding(r, th):
-    return [float(_ > th) for _ in r]
+sweep_num = 500  # Number of thresholds in the sweep, at quantiles of dev scores.
+chunk_size = 10000  # Number of instances counted at a time.
 
 
-def _numerize(r):
-    return [float(_) for _ in r.split(" ")]
+def _count(reader, thresholds):
+    """
+    Count predicted (score > threshold), true and true positive tokens of each instance
+    for all thresholds at once, with scores sorted into threshold bins once.
+    Inputs:
+        thresholds -- sorted thresholds, shape (threshold_num,).
+    Outputs:
+        n_pred, n_tp -- shape (instance_count, threshold_num).
+        n_true, n_all -- shape (instance_count,).
+    """
+    lens = reader.lengths()
+    doc = np.repeat(np.arange(len(lens)), lens)
+    true = np.asarray(reader.rationale_true, dtype=np.float64)
+    score = np.asarray(reader.rationale_pred, dtype=np.float64)
 
+    # Score of a token is above thresholds[:bin].
+    bins = np.searchsorted(thresholds, score, side="left")
+    n_bins = len(thresholds) + 1
 
-def test_threshold(df, thresholds):
-    df["true"] = df["rationale_true"].apply(_numerize)
-    df["score"] = df["rationale_pred"].apply(_numerize)
-    df["mask"] = df["mask"].apply(_numerize)
-    
-    for th in thresholds:
-        df["pred"] = df["score"].apply(lambda r: _thresholding(r, th))
+    n_pred = np.zeros((len(lens), len(thresholds)))
+    n_tp = np.zeros((len(lens), len(thresholds)))
+    for start in range(0, len(lens), chunk_size):
+        end = min(start + chunk_size, len(lens))
+        begin, stop = reader.offsets[start], reader.offsets[end]
+        cell = (doc[begin: stop] - start) * n_bins + bins[begin: stop]
+        pred = np.bincount(cell, minlength=(end - start) * n_bins).reshape(-1, n_bins)
+        tp = np.bincount(cell, weights=true[begin: stop], minlength=(end - start) * n_bins).reshape(-1, n_bins)
 
-        for metric_name, metric_func in metric_funcs.items():
-            df[metric_name] = df.apply(lambda r: metric_func(r["true"], r["pred"], r["mask"], average="binary"), axis=1)
-            print(th, "\t", metric_name, "\t", df[metric_name].mean())
+        # Tokens predicted at threshold j fall into bins j + 1, ..., threshold_num.
+        n_pred[start: end] = np.cumsum(pred[:, ::-1], axis=1)[:, ::-1][:, 1:]
+        n_tp[start: end] = np.cumsum(tp[:, ::-1], axis=1)[:, ::-1][:, 1:]
+
+    n_true = np.bincount(doc, weights=true, minlength=len(lens))
+    return n_pred, n_tp, n_true, lens.astype(np.float64)
+
+
+def sweep(reader, thresholds):
+    """
+    Average per-instance metrics of binarized rationales over a set for all thresholds.
+    Metrics are nan for instances where they are undefined, and nan is ignored in averages,
+    the same as the binary metrics in runners/metrics.py.
+    Outputs:
+        curve -- a dataframe of threshold, precision, recall, f1, percentage and f1_annotated.
+    """
+    thresholds = np.unique(np.asarray(thresholds, dtype=np.float64))
+    n_pred, n_tp, n_true, n_all = _count(reader, thresholds)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        metrics = {
+            "precision": np.where(n_pred > 0, n_tp / n_pred, np.nan),
+            "recall": np.where(n_true[:, None] > 0, n_tp / n_true[:, None], np.nan),
+            "f1": np.where((n_pred > 0) & (n_true[:, None] > 0),
+                           2 * n_tp / (n_pred + n_true[:, None]), np.nan),
+            "percentage": np.where(n_all[:, None] > 0, n_pred / n_all[:, None], np.nan),
+            # F1 over annotated instances, 0 if nothing is predicted, to pick thresholds.
+            "f1_annotated": np.where(n_true[:, None] > 0, 2 * n_tp / (n_pred + n_true[:, None]), np.nan),
+        }
+    curve = pd.DataFrame({"threshold": thresholds})
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)  # Averages of all-nan are nan.
+        for metric_name, values in metrics.items():
+            curve[metric_name] = np.nanmean(values, axis=0)
+    return curve
+
+
+def pick_threshold(curve, default):
+    """
+    Pick the threshold with the best f1 over annotated instances,
+    or the one closest to the default threshold if there are no annotations.
+    """
+    if curve["f1_annotated"].notna().any():
+        return float(curve["threshold"][curve["f1_annotated"].idxmax()])
+    return float(curve["threshold"][(curve["threshold"] - default).abs().idxmin()])
 
 
 def binarize(out_path, args):
 
-    # set_names = ["train", "dev", "test"]  # Analyze all.
-    set_names = ["dev", "test"]
+    set_names = ["train", "dev", "test"]  # Analyze all.
+    readers = {set_name: RationaleReader(out_path, set_name) for set_name in set_names}
+
+    # Sweep thresholds at quantiles of dev scores, with the configured ones.
+    scores = np.asarray(readers["dev"].rationale_pred, dtype=np.float64)
+    thresholds = list(args.test_thresholds) + [args.binarize_threshold]
+    if len(scores):
+        thresholds += np.quantile(scores, np.linspace(0, 1, sweep_num)).tolist()
+
+    curves = {}
     for set_name in set_names:
         print(set_name)
-        set_path = os.path.join(out_path, set_name + ".tsv")
-        df = pd.read_csv(set_path, sep="\t")
-        test_threshold(df, args.test_thresholds)
+        curves[set_name] = sweep(readers[set_name], thresholds)
+        curves[set_name].to_csv(os.path.join(out_path, set_name + "_thresholds.csv"), index=False)
+        curve = curves[set_name].set_index("threshold")
+        for th in args.test_thresholds:
+            for metric_name in ["precision", "percentage"]:
+                print(th, "\t", metric_name, "\t", curve[metric_name][th])
+
+    # Pick the operating point on dev.
+    threshold = pick_threshold(curves["dev"], args.binarize_threshold)
+    point = {set_name: curves[set_name].set_index("threshold").loc[threshold].to_dict()
+             for set_name in set_names}
+    point["threshold"] = threshold
+    print("Operating point:", point)
+    with open(os.path.join(out_path, "operating_point.json"), "w") as f:
+        f.write(json.dumps(point, indent=4))
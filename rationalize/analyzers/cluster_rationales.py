@@ -1,7 +1,8 @@
 # coding: utf-8
 
 
-import os, json, shutil, random, heapq
+import os, json, shutil, random, heapq, time, tracemalloc, hashlib
+import multiprocessing as mp
 import numpy as np
 import pandas as pd
 import matplotlib
@@ -10,6 +11,8 @@ from matplotlib.pyplot import *
 from matplotlib.font_manager import FontProperties
 from scipy.cluster import hierarchy
 from scipy.cluster.hierarchy import linkage, fcluster, dendrogram
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.metrics import adjusted_rand_score
 from wordcloud import WordCloud
 from cairosvg import svg2png
 from PIL import Image
@@ -44,6 +47,30 @@ pastel_colors = [
 default_color = "#000000"
 
 
+# Scalable clustering settings.
+centroid_num = 1000  # Max number of k-means centroids, i.e., leaves of the dendrogram.
+assign_chunk_size = 10000  # Number of rationales assigned to centroids at a time.
+
+
+def _render_wordcloud(task):
+    rationale_freq, mask_path, fig_path = task
+    mask = np.array(Image.open(mask_path))
+
+    rationale_freq = {k: min(v, 30) for k, v in rationale_freq.items()}
+    print(rationale_freq)
+
+    # Plot wordcloud.
+    wc = WordCloud(mask=mask,
+                   background_color=None,  # Transparent background.
+                   mode="RGBA",  # Transparent background.
+                   color_func=lambda *_, **__: default_color,  # Default color text.
+                   relative_scaling=.5,
+                   prefer_horizontal=0.9999,
+                   max_font_size=50)
+    wc.generate_from_frequencies(rationale_freq)
+    wc.to_file(fig_path)
+
+
 class Cluster(object):
     """
     Dataset Cluster for movie reviews.
@@ -56,15 +83,19 @@ class Cluster(object):
             "rationale_embeddings" + train_args.cluster_postfix + ".csv"
         )
         
-        self.df = pd.read_csv(self.embeddings_path).dropna()
-        self.df["embeddings"] = self.df["embeddings"].apply(
-            lambda e: [float(_) for _ in e.split(" ")]
-        )
+        # Embeddings are rows of the .npy aligned with the .csv, drop rationales without embeddings.
+        self.df = pd.read_csv(self.embeddings_path)
+        embeddings = np.load(self.embeddings_path.replace(".csv", ".npy"))
+        valid = self.df.notna().all(axis=1).values & ~np.isnan(embeddings).any(axis=1)
+        self.df = self.df[valid].reset_index(drop=True)
+        self.embeddings = embeddings[valid]
         print("Number of rationales:", len(self.df))
         
         self.labels = train_args.cluster_labels
         self.cluster_path = cluster_path
         self.cluster_num = train_args.cluster_num
+        self.cluster_mode = getattr(train_args, "cluster_mode", "exact")  # exact or scalable.
+        self.num_workers = train_args.num_workers
 
 
     def _plot_dendrogram(self, Z, fig_path):
@@ -83,11 +114,20 @@ class Cluster(object):
         return R
 
 
-    def _plot_wordcloud(self, rationale_freq, rationale_num, cluster_color, fig_path):
-        
-        # Generate a mask, rounded rectangular on left side.
-        mask_svg_path = fig_path.replace(".png", "_mask.svg")
-        mask_png_path = fig_path.replace(".png", "_mask.png")
+    def _get_mask(self, rationale_num, cluster_color):
+        """
+        Get the path of a mask, rounded rectangular on left side, cached by height and color.
+        """
+        masks_path = os.path.join(self.cluster_path, "masks")
+        if not os.path.exists(masks_path):
+            os.mkdir(masks_path)
+        mask_name = "{:d}_{}".format(rationale_num, cluster_color.lstrip("#"))
+        mask_svg_path = os.path.join(masks_path, mask_name + ".svg")
+        mask_png_path = os.path.join(masks_path, mask_name + ".png")
+        if os.path.exists(mask_png_path):
+            return mask_png_path
+
+        # Generate a mask.
         width = 600
         rounded = width * 0.025
         stroke = 3
@@ -130,21 +170,7 @@ class Cluster(object):
             bytestring=mask_svg.replace("none", "#ffffff"),
             write_to=mask_png_path
         )
-        mask = np.array(Image.open(mask_png_path))
-
-        rationale_freq = {k: min(v, 30) for k, v in rationale_freq.items()}
-        print(rationale_freq)
-
-        # Plot wordcloud.
-        wc = WordCloud(mask=mask,
-                       background_color=None,  # Transparent background.
-                       mode="RGBA",  # Transparent background.
-                       color_func=lambda *_, **__: default_color,  # Default color text.
-                       relative_scaling=.5,
-                       prefer_horizontal=0.9999,
-                       max_font_size=50)
-        wc.generate_from_frequencies(rationale_freq)
-        wc.to_file(fig_path)
+        return mask_png_path
 
 
     def _get_rationale_freq(self, g):
@@ -154,16 +180,61 @@ class Cluster(object):
         return rationale_freq
 
     
+    def _cluster_exact(self, X):
+        """
+        Complete linkage on all rationales, O(n^2) memory.
+        Outputs:
+            Z -- linkage matrix of rationales.
+            T -- cluster labels of rationales, shape (n,).
+        """
+        Z = linkage(X, method="complete", metric="cosine", optimal_ordering=False)  # Linkage metrix.
+        T = fcluster(Z, criterion="maxclust", t=self.cluster_num)  # Cluster labels.
+        return Z, T
+
+
+    def _cluster_scalable(self, X):
+        """
+        Mini-batch k-means on normalized rationales, nearest-centroid assignment in chunks,
+        and complete linkage on the centroids, which are the leaves of the dendrogram.
+        Outputs:
+            Z -- linkage matrix of centroids.
+            T -- cluster labels of rationales, shape (n,).
+        """
+        X = X / np.maximum(np.linalg.norm(X, axis=1, keepdims=True), 1e-12)  # Cosine as euclidean.
+        kmeans = MiniBatchKMeans(n_clusters=min(centroid_num, len(X)), batch_size=4096,
+                                 n_init=3, random_state=0)
+        kmeans.fit(X)
+        C = kmeans.cluster_centers_
+        C = C / np.maximum(np.linalg.norm(C, axis=1, keepdims=True), 1e-12)
+
+        # Assign rationales to the most similar centroids.
+        assign = np.concatenate([np.argmax(X[start: start + assign_chunk_size].dot(C.T), axis=1)
+                                 for start in range(0, len(X), assign_chunk_size)])
+
+        # Link centroids with rationales.
+        used, assign = np.unique(assign, return_inverse=True)
+        Z = linkage(C[used], method="complete", metric="cosine", optimal_ordering=False)
+        T = fcluster(Z, criterion="maxclust", t=self.cluster_num)[assign]
+        return Z, T
+
+
     def clust(self, label):
         label_cluster_path = os.path.join(self.cluster_path, label)
         if not os.path.exists(label_cluster_path):
             os.mkdir(label_cluster_path)
             
-        df = self.df[self.df["label"] == label].reset_index()
-        X = np.array(df["embeddings"].tolist())
-        
-        Z = linkage(X, method="complete", metric="cosine", optimal_ordering=False)  # Linkage metrix.
-        T = fcluster(Z, criterion="maxclust", t=self.cluster_num)  # Cluster labels.
+        is_label = (self.df["label"] == label).values
+        df = self.df[is_label].reset_index()
+        X = self.embeddings[is_label]
+
+        begin = time.time()
+        if self.cluster_mode == "exact":
+            Z, T = self._cluster_exact(X)
+        elif self.cluster_mode == "scalable":
+            Z, T = self._cluster_scalable(X)
+        else:
+            raise ValueError("Unknown cluster mode: %s" % self.cluster_mode)
+        print(label, self.cluster_mode, "clustering of", len(X), "rationales: %.2f seconds." % (time.time() - begin))
         df["cluster"] = pd.Series(T)
 
         fig_path = os.path.join(label_cluster_path, "dendrogram.svg")
@@ -171,6 +242,7 @@ class Cluster(object):
         
         words_path = os.path.join(label_cluster_path, "clusters.json")
         words = open(words_path, "w")
+        tasks = []
         for _, g in df.groupby("cluster"):
             cluster_id = int(g["cluster"].tolist()[-1] - 1)
             cluster_color = regular_colors[cluster_id % len(regular_colors)]
@@ -178,13 +250,83 @@ class Cluster(object):
             fig_path = os.path.join(label_cluster_path, "{:03d}".format(cluster_id) + ".png")
             rationale_freq = self._get_rationale_freq(g)
             words.write(json.dumps(rationale_freq) + "\n")
-            self._plot_wordcloud(rationale_freq, rationale_num, cluster_color, fig_path)
+            tasks.append((rationale_freq, self._get_mask(rationale_num, cluster_color), fig_path))
         words.close()
+        return tasks
+
+
+    def render(self, tasks):
+        """
+        Render word clouds, with self.num_workers processes if any.
+        Word clouds whose frequencies and masks are unchanged since the last run are skipped.
+        """
+        records, pending = {}, []
+        for task in tasks:
+            rationale_freq, mask_path, fig_path = task
+            record_path = os.path.join(os.path.dirname(fig_path), "wordclouds.json")
+            if record_path not in records:
+                records[record_path] = {}
+                if os.path.exists(record_path):
+                    with open(record_path, "r") as f:
+                        records[record_path] = json.load(f)
+            key = hashlib.sha1(json.dumps([rationale_freq, os.path.basename(mask_path)]).encode("utf-8")).hexdigest()
+            fig_name = os.path.basename(fig_path)
+            if records[record_path].get(fig_name) == key and os.path.exists(fig_path):
+                continue
+            records[record_path][fig_name] = key
+            pending.append(task)
+        print("Word clouds to render:", len(pending), "of", len(tasks))
+
+        if self.num_workers > 0 and len(pending) > 1:
+            pool = mp.get_context("fork").Pool(self.num_workers)
+            pool.map(_render_wordcloud, pending, chunksize=1)
+            pool.close()
+            pool.join()
+        else:
+            for task in pending:
+                _render_wordcloud(task)
+
+        for record_path, record in records.items():
+            with open(record_path, "w") as f:
+                f.write(json.dumps(record, indent=4))
+
+
+def benchmark(vector_path, cluster_path, train_args, sizes=(1000, 2000, 5000, 10000, 20000)):
+    """
+    Compare runtime, peak memory and agreement (adjusted rand index)
+    of scalable clustering with exact linkage, on samples of rationales where both run.
+    """
+    if not os.path.exists(cluster_path):
+        os.mkdir(cluster_path)
+    cluster = Cluster(vector_path, cluster_path, train_args)
+    report = {}
+    for label in cluster.labels:
+        X = cluster.embeddings[(cluster.df["label"] == label).values]
+        report[label] = []
+        for size in sizes:
+            if size > len(X):
+                break
+            sample = X[np.random.RandomState(0).choice(len(X), size, replace=False)]
+            result, labels_ = {"size": size}, {}
+            for mode, func in [("exact", cluster._cluster_exact), ("scalable", cluster._cluster_scalable)]:
+                begin = time.time()
+                tracemalloc.start()
+                labels_[mode] = func(sample)[1]
+                result[mode + "_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+                tracemalloc.stop()
+                result[mode + "_seconds"] = time.time() - begin
+            result["adjusted_rand"] = adjusted_rand_score(labels_["exact"], labels_["scalable"])
+            print(label, result)
+            report[label].append(result)
+    with open(os.path.join(cluster_path, "benchmark.json"), "w") as f:
+        f.write(json.dumps(report, indent=4))
 
 
 def clust(vector_path, cluster_path, train_args):
     if not os.path.exists(cluster_path):
         os.mkdir(cluster_path)
     cluster = Cluster(vector_path, cluster_path, train_args)
+    tasks = []
     for label in cluster.labels:
-        cluster.clust(label)
+        tasks += cluster.clust(label)
+    cluster.render(tasks)
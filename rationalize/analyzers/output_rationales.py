@@ -4,57 +4,240 @@
 import torch
 from torch.autograd import Variable
 
-import os
+import os, shutil, argparse
+import multiprocessing as mp
 import numpy as np
 
+from utils.quantizer import load_model
+from utils.rationale_store import RationaleWriter, RationaleReader
+from utils.rationale_cache import RationaleCache, fingerprint, doc_key
+
+
+def _output_batch(model, data, set_name, batch_idx, args):
+    """
+    Get rationales of a batch.
+    Outputs:
+        ids, r, z, m -- numpy arrays of ids, rationale annotations, rationales and masks.
+    """
+
+    samples = data.get_batch(set_name, batch_idx=batch_idx, sort=True, return_id=True)
+    x, y, m, r, s, d, ids = samples
+
+    # Save values to torch tensors.
+    x = Variable(torch.from_numpy(x))
+    y = Variable(torch.from_numpy(y))
+    m = Variable(torch.from_numpy(m)).float()
+    r = Variable(torch.from_numpy(r)).float()
+    s = Variable(torch.from_numpy(s)).float()
+    d = Variable(torch.from_numpy(d)).float()
+    if args.cuda:
+        x = x.cuda()
+        y = y.cuda()
+        m = m.cuda()
+        r = r.cuda()
+        s = s.cuda()
+        d = d.cuda()
+
+    # Get soft or hard rationales, (batch_size, seq_len).
+    _, _, z, _, _ = model(x, m)
+
+    return ids, r.cpu().numpy(), z.detach().cpu().numpy(), m.cpu().numpy()
+
+
+# States shared with forked workers.
+_worker = {}
+
+
+def _init_worker(ckpt_path, data, args):
+    args = argparse.Namespace(**vars(args))
+    args.cuda = 0  # Workers run on CPU.
+    torch.set_num_threads(args.threads_per_worker)  # Bound threads per worker.
+    _worker["model"] = load_model(ckpt_path, cpu=True, quantized=bool(args.quantize))
+    _worker["model"].eval()
+    _worker["data"] = data
+    _worker["args"] = args
+
+
+def _output_shard(task):
+    """
+    Write rationales of a shard, i.e., a list of batches of a set, in float32.
+    """
+    set_name, shard_path, batches = task
+    model, data, args = _worker["model"], _worker["data"], _worker["args"]
+    writer = RationaleWriter(os.path.dirname(shard_path), os.path.basename(shard_path),
+                             "binary", precision=".f32")
+    with torch.no_grad():
+        for batch_idx in batches:
+            writer.write(*_output_batch(model, data, set_name, batch_idx, args))
+    writer.close()
+    return shard_path
 
-def output(ckpt_path, out_path, data, args):
 
-    model = torch.load(ckpt_path)  # Load model from checkpoint.    
+def _run_shards(ckpt_path, shards_path, data, set_batches, args):
+    """
+    Score batches with args.num_workers processes on CPU.
+    Batches of each set are split into contiguous shards, one per worker.
+    Inputs:
+        set_batches -- {set_name: [batch_idx, ...]}.
+    Outputs:
+        {set_name: [shard_path, ...]} in the order of batches.
+    """
+
+    if os.path.exists(shards_path):
+        shutil.rmtree(shards_path)
+    os.mkdir(shards_path)
+
+    tasks = []
+    for set_name, batches in set_batches.items():
+        for shard_id, shard in enumerate(np.array_split(np.arange(len(batches)), args.num_workers)):
+            if len(shard):
+                shard_path = os.path.join(shards_path, "%s.%03d" % (set_name, shard_id))
+                tasks.append((set_name, shard_path, [batches[i] for i in shard]))
+
+    # Workers are forked to share the loaded data.
+    pool = mp.get_context("fork").Pool(args.num_workers, initializer=_init_worker,
+                                       initargs=(ckpt_path, data, args))
+    shard_paths = pool.map(_output_shard, tasks, chunksize=1)
+    pool.close()
+    pool.join()
+
+    return {set_name: [p for (s, _, _), p in zip(tasks, shard_paths) if s == set_name]
+            for set_name in set_batches}
+
+
+def _merge_shards(shard_paths, out_path, set_name, args):
+    """
+    Merge shards of a set in the order of batches, writing a batch at a time padded to its longest instance,
+    so the output is the same as without shards, in either format.
+    """
+    writer = RationaleWriter(out_path, set_name, args.output_format)
+    for p in shard_paths:
+        reader = RationaleReader(os.path.dirname(p), os.path.basename(p))
+        lens = reader.lengths()
+        for start in range(0, len(reader), args.batch_size):  # Shards hold whole batches.
+            end = min(start + args.batch_size, len(reader))
+            r = np.zeros((end - start, lens[start: end].max()), dtype=np.float32)
+            z = np.zeros(r.shape, dtype=np.float32)
+            m = np.zeros(r.shape, dtype=np.float32)
+            for j, i in enumerate(range(start, end)):
+                r[j, :lens[i]], z[j, :lens[i]] = reader.get(i)
+                m[j, :lens[i]] = 1
+            writer.write(reader.ids[start: end], r, z, m)
+    writer.close()
+
+
+def output_sharded(ckpt_path, out_path, data, args):
+    """
+    Output rationales with args.num_workers processes on CPU.
+    Batches of each set are split into contiguous shards, one per worker,
+    so the merged output is the same regardless of the number of workers, and as without workers.
+    """
+
+    set_names = ["train", "dev", "test"]  # Analyze all.
+    set_batches = {}
+    for set_name in set_names:
+        instance_count = data.data_sets[set_name].size()
+        set_batches[set_name] = [range(start, min(start + args.batch_size, instance_count))
+                                 for start in range(0, instance_count, args.batch_size)]
+
+    shards_path = os.path.join(out_path, "shards")
+    shard_paths = _run_shards(ckpt_path, shards_path, data, set_batches, args)
+    for set_name in set_names:
+        _merge_shards(shard_paths[set_name], out_path, set_name, args)
+    shutil.rmtree(shards_path)
+
+
+def output_cached(ckpt_path, out_path, data, args):
+    """
+    Output rationales, scoring only documents whose token ids are not in the rationale cache,
+    i.e., new or changed documents, with args.num_workers processes if any.
+    The cache is kept in out_path/cache/ and invalidated if the checkpoint or vocabulary changes.
+    """
+
+    cache = RationaleCache(os.path.join(out_path, "cache"),
+                           fingerprint(ckpt_path, data.word_vocab, args))
+
+    # Look up documents by hashes of their (truncated) token ids.
+    set_names = ["train", "dev", "test"]  # Analyze all.
+    id2key, set_batches = {}, {}
+    for set_name in set_names:
+        pairs = data.data_sets[set_name].pairs
+        keys = [doc_key(pair["tokens"][:args.truncate_num] if args.truncate_num > 0 else pair["tokens"])
+                for pair in pairs]
+        id2key[set_name] = {pair["id"]: key for pair, key in zip(pairs, keys)}
+        misses = cache.lookup(keys)
+        set_batches[set_name] = [misses[start: start + args.batch_size]
+                                 for start in range(0, len(misses), args.batch_size)]
+
+    # Score missed documents.
+    if any(set_batches.values()) and args.num_workers > 0:
+        shards_path = os.path.join(out_path, "shards")
+        shard_paths = _run_shards(ckpt_path, shards_path, data, set_batches, args)
+        for set_name, paths in shard_paths.items():
+            for p in paths:
+                reader = RationaleReader(os.path.dirname(p), os.path.basename(p))
+                for i, id_ in enumerate(reader.ids.tolist()):
+                    cache.put(id2key[set_name][id_], reader.get(i)[1])
+        shutil.rmtree(shards_path)
+    elif any(set_batches.values()):
+        model = load_model(ckpt_path, quantized=bool(args.quantize))  # Load model from checkpoint.
+        model.eval()  # Set model to eval mode.
+        with torch.no_grad():
+            for set_name, batches in set_batches.items():
+                for batch_idx in batches:
+                    ids, r, z, m = _output_batch(model, data, set_name, batch_idx, args)
+                    for id_, z_, m_ in zip(ids.tolist(), z, m):
+                        cache.put(id2key[set_name][id_], z_[:int(m_.sum())])
+
+    # Write all rationales from the cache.
+    for set_name in set_names:
+        writer = RationaleWriter(out_path, set_name, args.output_format)
+        instance_count = data.data_sets[set_name].size()
+        for start in range(0, instance_count, args.batch_size):
+            batch_idx = range(start, min(start + args.batch_size, instance_count))
+            _, _, m, r, _, _, ids = data.get_batch(set_name, batch_idx=batch_idx, sort=True, return_id=True)
+            z = np.zeros(m.shape, dtype=np.float32)
+            for i, id_ in enumerate(ids.tolist()):
+                z_ = cache.get(id2key[set_name][id_])
+                z[i, :len(z_)] = z_
+            writer.write(ids, r.astype(np.float32), z, m.astype(np.float32))
+        writer.close()
+
+    cache.save()
+    print("Rationale cache:", cache.stats())
+
+
+def output(ckpt_path, out_path, data, args):
 
     if not os.path.exists(out_path):
         os.mkdir(out_path)
-    
+
+    if args.rationale_cache:  # Score only documents not in the cache.
+        output_cached(ckpt_path, out_path, data, args)
+        return
+
+    if args.num_workers > 0:  # Sharded output with multiple processes.
+        output_sharded(ckpt_path, out_path, data, args)
+        return
+
+    model = load_model(ckpt_path, quantized=bool(args.quantize))  # Load model from checkpoint.
+
     model.eval()  # Set model to eval mode.
-    
+
     set_names = ["train", "dev", "test"]  # Analyze all.
     for set_name in set_names:
-        f = open(os.path.join(out_path, set_name + ".tsv"), "w")
-        f.write("index\trationale_true\trationale_pred\tmask\n")
-        
+        writer = RationaleWriter(out_path, set_name, args.output_format)
+
         instance_count = data.data_sets[set_name].size()
         for start in range(instance_count // args.batch_size + 1):
 
             # Get a batch.
             batch_idx = range(start * args.batch_size,
                               min((start + 1) * args.batch_size, instance_count))
-            samples = data.get_batch(set_name, batch_idx=batch_idx, sort=True, return_id=True)
-            x, y, m, r, s, d, ids = samples
-
-            # Save values to torch tensors.
-            x = Variable(torch.from_numpy(x))
-            y = Variable(torch.from_numpy(y))
-            m = Variable(torch.from_numpy(m)).float()
-            r = Variable(torch.from_numpy(r)).float()
-            s = Variable(torch.from_numpy(s)).float()
-            d = Variable(torch.from_numpy(d)).float()
-            if args.cuda:
-                x = x.cuda()
-                y = y.cuda()
-                m = m.cuda()
-                r = r.cuda()
-                s = s.cuda()
-                d = d.cuda()
-
-            # Get soft or hard rationales, (batch_size, seq_len).
-            _, _, z, _, _ = model(x, m)
-
-            # Get writable text from list.
-            z = [" ".join([str(z__) for z__ in z_]) for z_ in z.tolist()]
-            r = [" ".join([str(r__) for r__ in r_]) for r_ in r.tolist()]
-            m = [" ".join([str(m__) for m__ in m_]) for m_ in m.tolist()]
-            for id_, z_, r_, m_ in zip(ids, z, r, m):
-                line = str(id_) + "\t" + r_ + "\t" + z_ + "\t" + m_ + "\n"
-                f.write(line)
-        
-        f.close()
+            if not batch_idx:  # The last batch is empty if the set size is a multiple of batch_size.
+                continue
+
+            # Write in the background.
+            writer.write(*_output_batch(model, data, set_name, batch_idx, args))
+
+        writer.close()
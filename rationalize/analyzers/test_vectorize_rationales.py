@@ -0,0 +1,52 @@
+# coding: utf-8
+
+
+import os, sys, unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from analyzers.vectorize_rationales import binarize_on_neighbors, _binarize_on_neighbors_naive
+
+
+class TestBinarizeOnNeighbors(unittest.TestCase):
+    """
+    Binarize seeded random soft rationales, with many tied scores, against the naive binarization.
+    """
+
+    def assertBinarized(self, softs, damp):
+        lens = [len(soft) for soft in softs]
+        offsets = np.concatenate([[0], np.cumsum(lens, dtype=np.int64)])
+        scores = np.array([s for soft in softs for s in soft], dtype=np.float64)
+        expected = [h for soft in softs if soft for h in _binarize_on_neighbors_naive(list(soft), damp)]
+        self.assertEqual(binarize_on_neighbors(scores, offsets, damp).tolist(), expected, (softs, damp))
+
+
+    def test_ties(self):
+        # Scores of a few levels, so seeds, neighbors and bounds are tied a lot.
+        rng = np.random.RandomState(0)
+        for _ in range(300):
+            levels = rng.choice([0.0, 0.1, 0.25, 0.5, 0.75, 1.0], size=rng.randint(2, 6), replace=False)
+            softs = []
+            for _ in range(rng.randint(1, 6)):
+                soft = rng.choice(levels, size=rng.randint(0, 30)).tolist()
+                if soft and max(soft) == 0:  # The naive one never stops on all zeros.
+                    soft[rng.randint(len(soft))] = 0.5
+                softs.append(soft)
+            self.assertBinarized(softs, rng.choice([0.1, 0.25, 0.5, 0.8, 1.0]))
+
+
+    def test_random(self):
+        rng = np.random.RandomState(1)
+        for _ in range(100):
+            softs = [rng.rand(rng.randint(0, 50)).tolist() for _ in range(rng.randint(1, 6))]
+            self.assertBinarized(softs, rng.uniform(0.05, 1.0))
+
+
+    def test_empty(self):
+        self.assertBinarized([], 0.5)
+        self.assertBinarized([[], [], []], 0.5)
+        self.assertBinarized([[], [0.5, 0.5, 0.5], []], 1.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
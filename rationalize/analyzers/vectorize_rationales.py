@@ -1,12 +1,90 @@
 # coding: utf-8
 
 
-import os
+import os, time, heapq
+import multiprocessing as mp
 import numpy as np
 import pandas as pd
+from scipy import sparse
+from collections import deque
 from nltk.corpus import stopwords
 from nltk.stem.wordnet import WordNetLemmatizer
 
+from utils.rationale_store import RationaleReader
+from utils.word_vectors import load_word_vectors
+
+
+def binarize_on_neighbors(scores, offsets, damp):
+    """
+    Binarize soft rationales of instances by growing spans from high-score seeds,
+    the same as _binarize_on_neighbors_naive() but in O(L log L) per instance.
+    Tokens are popped from a heap in descending score order (ties by position), and each seed
+    extends to neighbors scoring above seed * damp, until a selected token is met.
+    Seeds must score at least max * damp, which is checked for all instances at once.
+    Inputs:
+        scores -- soft rationales of all instances concatenated, shape (token_count,).
+        offsets -- offsets of instances, shape (instance_count + 1,).
+    Outputs:
+        hard -- 0/1 rationales of all instances concatenated, shape (token_count,).
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lens = np.diff(offsets)
+    hard = np.zeros(len(scores), dtype=np.int64)
+    if not len(scores):
+        return hard
+
+    # Seeds of all instances.
+    nonempty = np.flatnonzero(lens > 0)
+    max_vals = np.full(len(lens), np.inf)
+    max_vals[nonempty] = np.maximum.reduceat(scores, offsets[nonempty])
+    seeds = np.flatnonzero(scores >= np.repeat(max_vals, lens) * damp)
+    seed_docs = np.repeat(np.arange(len(lens)), lens)[seeds]
+    seed_offsets = np.searchsorted(seed_docs, np.arange(len(lens) + 1))
+
+    selected = np.zeros(len(scores), dtype=bool)
+    scores_ = scores.tolist()
+    for doc in nonempty.tolist():
+        start, end = int(offsets[doc]), int(offsets[doc + 1])
+        heap = [(-scores_[i], i) for i in seeds[seed_offsets[doc]: seed_offsets[doc + 1]].tolist()]
+        heapq.heapify(heap)
+        while heap:
+            neg_score, i = heapq.heappop(heap)
+            if selected[i]:  # Already in a span.
+                continue
+            selected[i] = True
+            bound = -neg_score * damp
+
+            # Adding left neighbors.
+            j = i - 1
+            while j >= start and not selected[j] and scores_[j] > bound:
+                selected[j] = True
+                j -= 1
+
+            # Adding right neighbors.
+            j = i + 1
+            while j < end and not selected[j] and scores_[j] > bound:
+                selected[j] = True
+                j += 1
+
+    hard[selected] = 1
+    return hard
+
+
+chunk_size = 1000  # Number of documents extracted at a time.
+
+
+# States shared with forked workers.
+_worker = {}
+
+
+def _init_worker(vectorizer):
+    _worker["vectorizer"] = vectorizer
+
+
+def _count_chunk(chunk):
+    return _worker["vectorizer"]._count_chunk(chunk)
+
 
 class Vectorizer(object):
     """
@@ -15,14 +93,8 @@ class Vectorizer(object):
 
 
     def __init__(self, data_path, rationale_path, vector_path, train_args):
-        dfs = []
-        for set_name in ["train", "dev", "test"]:
-            data = pd.read_csv(os.path.join(data_path, set_name + ".tsv"), sep="\t")
-            rationale = pd.read_csv(os.path.join(rationale_path, set_name + ".tsv"), sep="\t")
-            data["index"] = data.index
-            data = data.merge(rationale, on="index")
-            dfs.append(data)
-        self.df = pd.concat(dfs)
+        self.data_path = data_path
+        self.rationale_path = rationale_path
         self.vector_path = vector_path
         self.stopwords = stopwords.words("english")
         if train_args.binarize_mode == "threshold":
@@ -32,10 +104,18 @@ class Vectorizer(object):
             self.binarize_mode = "neighbors"
             self.damp = train_args.binarize_damp_factor
         self.embedding_dim = train_args.embedding_dim
+        self.num_workers = train_args.num_workers
         self.wnl = WordNetLemmatizer()
 
     
     def get_word2vec(self, embedding_path):
+        words, vectors = load_word_vectors(embedding_path)
+        if words is not None:  # Binary copy, cast from float32 to float64 as parsed from the text.
+            word2vec = dict(zip(words, np.asarray(vectors, dtype=np.float64)))
+            for word in self.stopwords:
+                word2vec[word] = np.zeros(self.embedding_dim)
+            self.word2vec = word2vec
+            return
         word2vec = {}
         with open(embedding_path) as f:
             word2vec_lines = f.read().split("\n")
@@ -50,36 +130,9 @@ class Vectorizer(object):
         
 
     def _binarize_on_neighbors(self, soft):
-        hard = [0] * len(soft)
-        max_val = max(soft)
-        
-        while True:
-            this_max_id = np.argmax(soft)
-            this_max_val = soft[this_max_id]
-        
-            if this_max_val < max_val * self.damp:
-                break
-            
-            hard[this_max_id] = 1  # Update hard.
-            soft[this_max_id] = 0  # Clear soft.
-            
-            # Adding left neighbors.
-            this_id = this_max_id - 1
-            while this_id > -1 and soft[this_id] > this_max_val * self.damp:
-                hard[this_id] = 1  # Update hard.
-                soft[this_id] = 0  # Clear soft.
-                this_id -= 1
-            
-            # Adding right neighbors.
-            this_id = this_max_id + 1
-            while this_id < len(soft) and soft[this_id] > this_max_val * self.damp:
-                hard[this_id] = 1  # Update hard.
-                soft[this_id] = 0  # Clear soft.
-                this_id += 1
+        return binarize_on_neighbors(soft, [0, len(soft)], self.damp).tolist()
+
 
-        return hard
-    
-    
     def _binarize_on_threshold(self, rationale_pred):
         return [float(_ > self.threshold) for _ in rationale_pred]
     
@@ -92,11 +145,9 @@ class Vectorizer(object):
         return False
 
 
-    def _get_rationale(self, row):
-        tokens = row["tokens"].split(" ")
-        rationale_pred = [float(r) for r, m in zip(row["rationale_pred"].split(" "),
-                                                   row["mask"].split(" ")
-                                                   ) if float(m) > 0]
+    def _get_rationale_phrases(self, tokens, rationale_pred):
+        tokens = tokens.split(" ")
+        rationale_pred = list(rationale_pred)
         assert len(rationale_pred) == len(tokens), "Error in length!"
         if self.binarize_mode == "threshold":
             rationale_binary = self._binarize_on_threshold(rationale_pred)
@@ -105,7 +156,6 @@ class Vectorizer(object):
         for i, t in enumerate(tokens):
             if self._nonrationale_tokens(t):
                 rationale_binary[i] = 0.0
-        row["rationale_len"] = sum(rationale_binary)
         rationale_phrases = [""]
         for i, r in enumerate(rationale_binary):
             if r == 0:  # If not selected.
@@ -114,58 +164,189 @@ class Vectorizer(object):
                     rationale_phrases.append("")
             elif r == 1:  # If selected, append a token.
                 rationale_phrases[-1] += tokens[i] + " "
-        row["rationale_phrases"] = rationale_phrases[:-1]
-        return row
-    
-    
-    def _get_embedding(self, row):
-        embedding = np.zeros(self.embedding_dim)
-        words = row["rationale"].split(" ")
+        return rationale_phrases[:-1]
 
+
+    def _read_chunks(self):
         """
-        # Lemmatization.
-        for grammar in ["a", "s", "r", "n", "v"]:
-            words = [self.wnl.lemmatize(word, grammar) for word in words]
+        Read documents with rationales of all sets in chunks, in the order of sets and rows.
+        Outputs:
+            chunks of [(tokens, label, rationale_pred), ...].
         """
-        
-        # Get embeddings.
-        for word in words:
-            if word not in self.word2vec:
-                return np.nan
-            embedding += self.word2vec[word]
-        embedding /= len(row["rationale"].split(" "))
-        
-        if sum(embedding) == 0:
-            return np.nan
-        return " ".join([str(e) for e in embedding])
+        for set_name in ["train", "dev", "test"]:
+            reader = RationaleReader(self.rationale_path, set_name)
+            id2idx = {id_: i for i, id_ in enumerate(reader.ids.tolist())}
+            data = pd.read_csv(os.path.join(self.data_path, set_name + ".tsv"), sep="\t",
+                               chunksize=chunk_size)
+            for data_chunk in data:
+                chunk = []
+                for index, tokens, label in zip(data_chunk.index, data_chunk["tokens"], data_chunk["label"]):
+                    if index in id2idx:  # Rationales are matched by row index.
+                        rationale_pred = reader.get(id2idx[index])[1].astype(np.float64).tolist()
+                        chunk.append((tokens, label, rationale_pred))
+                yield chunk
 
 
-    def _count_rationale(self, rationale_phrases_all):
-        count = {}
-        for rationale_phrases in rationale_phrases_all:
-            for rationale_phrase in rationale_phrases:
+    def _count_chunk(self, chunk):
+        """
+        Count rationale phrases of a chunk per label.
+        Outputs:
+            labels -- labels in the order of first occurrence.
+            counts -- {label: {rationale_phrase: count}}, phrases in the order of first occurrence.
+        """
+        labels, counts = [], {}
+        for tokens, label, rationale_pred in chunk:
+            if label not in counts:
+                labels.append(label)
+                counts[label] = {}
+            count = counts[label]
+            for rationale_phrase in self._get_rationale_phrases(tokens, rationale_pred):
                 if rationale_phrase not in count:
                     count[rationale_phrase] = 0
                 count[rationale_phrase] += 1
-        return count
+        return labels, counts
+
+
+    def _count_rationales(self):
+        """
+        Extract and count rationale phrases per label, streaming chunks of documents
+        through self.num_workers processes if any, with a bounded number of chunks in flight.
+        Chunk results are merged in order, so the counts are the same as in a single pass.
+        """
+        labels, counts = [], {}
+
+        def _merge(result):
+            for label in result[0]:
+                if label not in counts:
+                    labels.append(label)
+                    counts[label] = {}
+            for label, chunk_count in result[1].items():
+                count = counts[label]
+                for rationale_phrase, n in chunk_count.items():
+                    count[rationale_phrase] = count.get(rationale_phrase, 0) + n
 
+        if self.num_workers > 0:
+            pool = mp.get_context("fork").Pool(self.num_workers, initializer=_init_worker, initargs=(self,))
+            pending = deque()
+            for chunk in self._read_chunks():
+                pending.append(pool.apply_async(_count_chunk, (chunk,)))
+                if len(pending) >= 2 * self.num_workers:
+                    _merge(pending.popleft().get())
+            while pending:
+                _merge(pending.popleft().get())
+            pool.close()
+            pool.join()
+        else:
+            for chunk in self._read_chunks():
+                _merge(self._count_chunk(chunk))
+
+        return set(labels), counts
+    
     
+    def _get_embeddings(self, rationales):
+        """
+        Average word vectors of all rationale phrases at once,
+        as a sparse phrase x word count matrix times the word vector matrix.
+        Phrases with any word out of vocabulary, or with zero vectors, get nan.
+        Outputs:
+            embeddings -- shape (rationale_num, embedding_dim).
+        """
+        word2id = {}
+        rows, cols, lens = [], [], []
+        oov = np.zeros(len(rationales), dtype=bool)
+        for i, rationale in enumerate(rationales):
+            words = rationale.split(" ")
+            lens.append(len(words))
+            for word in words:
+                if word not in self.word2vec:
+                    oov[i] = True
+                    break
+                rows.append(i)
+                cols.append(word2id.setdefault(word, len(word2id)))
+
+        counts = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)),
+                                   shape=(len(rationales), len(word2id)))
+        vectors = np.zeros((len(word2id), self.embedding_dim))
+        for word, j in word2id.items():
+            vectors[j] = self.word2vec[word]
+        embeddings = counts.dot(vectors) / np.maximum(np.array(lens, dtype=np.float64), 1)[:, None]
+        embeddings[oov | (embeddings.sum(axis=1) == 0)] = np.nan
+        return embeddings
+
+
     def vectorize(self):
-        df = self.df.apply(self._get_rationale, axis=1)
-        labels = set(df["label"])
+        labels, counts = self._count_rationales()
         dfs = []
         for label in labels:
-            label_df = self._count_rationale(df[df["label"] == label]["rationale_phrases"].tolist())
-            label_df = pd.DataFrame.from_dict(label_df, orient="index", columns=["count"])
+            label_df = pd.DataFrame.from_dict(counts[label], orient="index", columns=["count"])
             label_df["label"] = label
             dfs.append(label_df)
         df = pd.concat(dfs)
         df = df.sort_values("count", ascending=False)
         df["rationale"] = df.index
-        df["embeddings"] = df.apply(self._get_embedding, axis=1)
+
+        # Embeddings are aligned with rows of the csv, nan rows for rationales without embeddings.
+        np.save(os.path.join(self.vector_path, "rationale_embeddings.npy"),
+                self._get_embeddings(df["rationale"].tolist()))
         df.to_csv(os.path.join(self.vector_path, "rationale_embeddings.csv"), index=False)
 
 
+def _binarize_on_neighbors_naive(soft, damp):
+    """
+    The original binarization, clearing soft in place, kept as the reference of binarize_on_neighbors().
+    """
+    hard = [0] * len(soft)
+    max_val = max(soft)
+
+    while True:
+        this_max_id = np.argmax(soft)
+        this_max_val = soft[this_max_id]
+
+        if this_max_val < max_val * damp:
+            break
+
+        hard[this_max_id] = 1  # Update hard.
+        soft[this_max_id] = 0  # Clear soft.
+
+        # Adding left neighbors.
+        this_id = this_max_id - 1
+        while this_id > -1 and soft[this_id] > this_max_val * damp:
+            hard[this_id] = 1  # Update hard.
+            soft[this_id] = 0  # Clear soft.
+            this_id -= 1
+
+        # Adding right neighbors.
+        this_id = this_max_id + 1
+        while this_id < len(soft) and soft[this_id] > this_max_val * damp:
+            hard[this_id] = 1  # Update hard.
+            soft[this_id] = 0  # Clear soft.
+            this_id += 1
+
+    return hard
+
+
+def benchmark_neighbors(rationale_path, damp):
+    """
+    Compare binarize_on_neighbors() with the naive binarization on all output rationales.
+    """
+    for set_name in ["train", "dev", "test"]:
+        reader = RationaleReader(rationale_path, set_name)
+        softs = [reader.get(i)[1].astype(np.float64).tolist() for i in range(len(reader))]
+
+        begin = time.time()
+        naive = [_binarize_on_neighbors_naive(list(soft), damp) if soft else [] for soft in softs]
+        naive_seconds = time.time() - begin
+
+        begin = time.time()
+        hard = binarize_on_neighbors(np.asarray(reader.rationale_pred, dtype=np.float64), reader.offsets, damp)
+        seconds = time.time() - begin
+
+        same = [h_ for h in naive for h_ in h] == hard.tolist()
+        print(set_name, {"instances": len(reader), "tokens": int(reader.offsets[-1]),
+                         "naive_seconds": naive_seconds, "seconds": seconds,
+                         "speedup": naive_seconds / max(seconds, 1e-9), "same": same})
+
+
 def vectorize(data_path, rationale_path, vector_path, train_args):
     
     if not os.path.exists(vector_path):
@@ -0,0 +1,160 @@
+# coding: utf-8
+
+
+import os, io, json
+import numpy as np
+import pandas as pd
+
+from utils.signal_store import cache_name, sha1, load_signals
+
+
+class CachedDataSet(object):
+    """
+    Binary cache of a parsed .tsv set, updated by parsing only rows appended to the .tsv.
+    The cache is valid as long as the .tsv starts with the bytes it was built from.
+    This stores:
+        words -- distinct tokens of the set, in order of appearance.
+        tokens -- ids of tokens in words, of all rows concatenated.
+        token_offsets -- offsets of rows in tokens, shape (row_count + 1,).
+        scores -- {column: [values, offsets]} of space separated score columns, the same way.
+        labels -- labels of rows.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.words = []
+        self.word2id = {}
+        self.tokens = np.zeros(0, dtype=np.int32)
+        self.token_offsets = np.zeros(1, dtype=np.int64)
+        self.scores = {column: [np.zeros(0), np.zeros(1, dtype=np.int64)] for column in columns}
+        self.labels = []
+        self.meta = {"size": 0, "rows": 0, "columns": columns}
+
+
+    def size(self):
+        return len(self.labels)
+
+
+    def get_token_ids(self, i):
+        return self.tokens[self.token_offsets[i]: self.token_offsets[i + 1]]
+
+
+    def get_scores(self, column, i):
+        values, offsets = self.scores[column]
+        return values[offsets[i]: offsets[i + 1]].tolist()
+
+
+    def append(self, df):
+        """
+        Parse rows of a dataframe the same way as ClassificationData.load_dataset, and append them.
+        """
+        tokens, lens = [], []
+        for t in df["tokens"].tolist():
+            ids = [self.word2id.setdefault(w, len(self.word2id)) for w in t.split(" ")]
+            tokens.extend(ids)
+            lens.append(len(ids))
+        self.words = list(self.word2id)
+        self.tokens = np.concatenate([self.tokens, np.array(tokens, dtype=np.int32)])
+        self.token_offsets = np.concatenate([self.token_offsets, self.token_offsets[-1] + np.cumsum(lens, dtype=np.int64)])
+
+        for column in self.columns:
+            values, lens = [], []
+            for s in df[column].tolist():
+                v = [float(_) if _ else 0. for _ in s.split(" ")]
+                values.extend(v)
+                lens.append(len(v))
+            old_values, old_offsets = self.scores[column]
+            self.scores[column] = [np.concatenate([old_values, np.array(values, dtype=np.float64)]),
+                                   np.concatenate([old_offsets, old_offsets[-1] + np.cumsum(lens, dtype=np.int64)])]
+
+        self.labels.extend(df["label"].tolist())
+
+
+    def save(self, path):
+        if not os.path.exists(path):
+            os.makedirs(path)
+        with open(os.path.join(path, "words.json"), "w") as f:
+            json.dump(self.words, f, ensure_ascii=False)
+        with open(os.path.join(path, "labels.json"), "w") as f:
+            json.dump(self.labels, f, ensure_ascii=False)
+        np.save(os.path.join(path, "tokens.npy"), self.tokens)
+        np.save(os.path.join(path, "token_offsets.npy"), self.token_offsets)
+        for column, (values, offsets) in self.scores.items():
+            np.save(os.path.join(path, column + ".npy"), values)
+            np.save(os.path.join(path, column + "_offsets.npy"), offsets)
+        with open(os.path.join(path, "meta.json"), "w") as f:  # Last, to mark the cache complete.
+            json.dump(self.meta, f)
+
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            meta = json.load(f)
+        cached = cls(meta["columns"])
+        cached.meta = meta
+        with open(os.path.join(path, "words.json"), "r") as f:
+            cached.words = json.load(f)
+        cached.word2id = {w: i for i, w in enumerate(cached.words)}
+        with open(os.path.join(path, "labels.json"), "r") as f:
+            cached.labels = json.load(f)
+        cached.tokens = np.load(os.path.join(path, "tokens.npy"))
+        cached.token_offsets = np.load(os.path.join(path, "token_offsets.npy"))
+        for column in cached.columns:
+            cached.scores[column] = [np.load(os.path.join(path, column + ".npy")),
+                                     np.load(os.path.join(path, column + "_offsets.npy"))]
+        return cached
+
+
+def load_cached_set(data_path, set_name, columns):
+    """
+    Load a set from the cache, parsing only rows appended to data_path/set_name.tsv since it was cached,
+    or all rows if the .tsv was otherwise changed.
+    Columns in binary signals of the set saved by data_signaler.py are taken from them instead of parsed.
+    Inputs:
+        columns -- space separated score columns to parse, kept with ones cached before.
+    Outputs:
+        cached -- a CachedDataSet, with ids of rows 0, 1, ... as in the .tsv.
+    """
+    signals = {column: [values.astype(np.float64), offsets]  # As float64 like parsed columns.
+               for column, (values, offsets) in load_signals(data_path, set_name, columns).items()}
+    columns = [column for column in columns if column not in signals]
+    cached = _load_cached_set(data_path, set_name, columns)
+    cached.scores.update(signals)
+    return cached
+
+
+def _load_cached_set(data_path, set_name, columns):
+    tsv_path = os.path.join(data_path, set_name + ".tsv")
+    cache_path = os.path.join(data_path, cache_name, set_name)
+    size = os.path.getsize(tsv_path)
+
+    cached = None
+    if os.path.exists(os.path.join(cache_path, "meta.json")):
+        cached = CachedDataSet.load(cache_path)
+        meta = cached.meta
+        if not set(columns) <= set(meta["columns"]):  # Parse all rows, keeping cached columns.
+            columns = meta["columns"] + [column for column in columns if column not in meta["columns"]]
+            cached = None
+        elif meta["size"] > size or sha1(tsv_path, meta["size"]) != meta["sha1"]:
+            cached = None
+        elif meta["size"] == size:  # Unchanged.
+            return cached
+
+    # Parse only appended rows with the header, or all rows.
+    dtype = {column: str for column in ["tokens"] + columns}  # Not inferred from appended rows only.
+    if cached is not None:
+        with open(tsv_path, "rb") as f:
+            header = f.readline()
+            f.seek(cached.meta["size"])
+            tail = f.read()
+        df = pd.read_csv(io.BytesIO(header + tail), sep="\t", dtype=dtype)
+        if cached.size() and len(df) and isinstance(cached.labels[0], str) != isinstance(df["label"].iloc[0], str):
+            cached = None  # Labels are typed differently from all rows.
+    if cached is None:
+        cached = CachedDataSet(columns)
+        df = pd.read_csv(tsv_path, sep="\t", dtype=dtype)
+    print("Caching %d rows of %s." % (len(df), set_name))
+    cached.append(df)
+    cached.meta = {"size": size, "sha1": sha1(tsv_path, size), "rows": cached.size(), "columns": columns}
+    cached.save(cache_path)
+    return cached
@@ -1,12 +1,15 @@
 # coding: utf-8
 
 
-import random, sys, os
+import random, sys, os, json
 import numpy as np
 import pandas as pd
 from colored import fg, attr, bg
 
 from datasets.dataset_operator import ClassificationDataSet
+from datasets.dataset_cache import load_cached_set
+from utils.signal_store import load_signals
+from utils.word_vectors import load_word_vectors
 
 
 class ClassificationData(object):
@@ -15,30 +18,42 @@ class ClassificationData(object):
     Functions need overwriting for a specific dataset.
     """
 
-    def __init__(self, data_path, args):
+    def __init__(self, data_path, args, set_names=("train", "dev", "test"), vocab_path=None):
         """
         Initialize a dataset for classification:
         Inputs:
             data_path -- the directory of the dataset.
             args.truncate_num -- max length for tokens.
             args.freq_threshold -- min frequency for tokens.
+            args.dataset_cache -- parse only rows not in the binary cache of sets, 0/1.
+            set_names -- sets to load.
+            vocab_path -- the vocabulary saved by save_vocab with a checkpoint, to index sets with
+                          instead of building the vocabulary from them.
         """
         self.data_path = data_path
         self.score_type = args.score_type
         self.truncate_num = args.truncate_num
         self.freq_threshold = args.freq_threshold
+        self.dataset_cache = getattr(args, "dataset_cache", 0)
+        self.cached_sets = {}
         
         self.word_vocab = {"<PAD>": 0, "<START>": 1, "<END>": 2, "<UNK>": 3}
         self.label_vocab = {}
+        if vocab_path is not None:
+            self.load_vocab(vocab_path)
 
         print("Loading dataset.")
-        self.data_sets = {"train": None, "dev": None, "test": None}
+        self.data_sets = {data_set: None for data_set in set_names}
         for data_set in self.data_sets:
             self.load_dataset(data_set)
             self.data_sets[data_set].print_info()
 
-        print("Building vocabulary.")
-        self._build_vocab()
+        if vocab_path is not None:
+            print("Indexing words with the saved vocabulary.")
+            self._index_vocab()
+        else:
+            print("Building vocabulary.")
+            self._build_vocab()
 
         print("Converting token to indexes.")
         self.idx2word = {val: key for key, val in self.word_vocab.items()}
@@ -79,6 +94,10 @@ class ClassificationData(object):
                 ret_pair_list.append(new_pair_dict_)
             return ret_pair_list
         
+        if self.cached_sets:  # Index words of cached sets by arrays.
+            self._build_vocab_cached()
+            return
+
         word_freq_dict = self._get_word_freq(self.data_sets)
             
         for data_id, data_set in self.data_sets.items():
@@ -87,6 +106,89 @@ class ClassificationData(object):
         print("Size of the final vocabulary:", len(self.word_vocab))
         
         
+    def _build_vocab_cached(self):
+        """
+        Filter the vocabulary and index words the same as _build_vocab,
+        with tokens of pairs as ids of words of cached sets.
+        """
+
+        # Ids of words over all sets, in order of appearance.
+        word2raw, local2raw = {}, {}
+        for data_id, cached in self.cached_sets.items():
+            local2raw[data_id] = np.array([word2raw.setdefault(w, len(word2raw)) for w in cached.words],
+                                          dtype=np.int64)
+        raw_words = list(word2raw)
+        raw_tokens = np.concatenate([np.zeros(0, dtype=np.int64)] +
+                                    [local2raw[data_id][pair_dict["tokens"]]
+                                     for data_id, data_set in self.data_sets.items()
+                                     for pair_dict in data_set.get_pairs()])
+        word_freq = np.bincount(raw_tokens, minlength=len(raw_words))
+        present, first = np.unique(raw_tokens, return_index=True)
+        print("Size of the raw vocabulary:", len(present))
+
+        # Add vocab in order of appearance.
+        raw2idx = np.full(len(raw_words), self.word_vocab["<UNK>"], dtype=np.int64)
+        for raw_id in present[np.argsort(first)]:
+            if word_freq[raw_id] >= self.freq_threshold:
+                raw2idx[raw_id] = self.word_vocab.setdefault(raw_words[raw_id], len(self.word_vocab))
+
+        for data_id, data_set in self.data_sets.items():
+            local2idx = raw2idx[local2raw[data_id]]
+            for pair_dict in data_set.get_pairs():
+                pair_dict["tokens"] = local2idx[pair_dict["tokens"]].tolist()
+            data_set.pairs = data_set.get_pairs()
+
+        print("Size of the final vocabulary:", len(self.word_vocab))
+
+
+    def _index_vocab(self):
+        """
+        Index words with the loaded vocabulary, words not in it as <UNK>,
+        the same as _build_vocab on the sets the vocabulary was built from.
+        """
+        unk = self.word_vocab["<UNK>"]
+        for data_id, data_set in self.data_sets.items():
+            if data_id in self.cached_sets:  # Tokens are ids of words of the cached set.
+                local2idx = np.array([self.word_vocab.get(w, unk) for w in self.cached_sets[data_id].words],
+                                     dtype=np.int64)
+                for pair_dict in data_set.get_pairs():
+                    pair_dict["tokens"] = local2idx[pair_dict["tokens"]].tolist()
+            else:
+                for pair_dict in data_set.get_pairs():
+                    pair_dict["tokens"] = [self.word_vocab.get(w, unk) for w in pair_dict["tokens"]]
+            data_set.pairs = data_set.get_pairs()
+
+        print("Size of the final vocabulary:", len(self.word_vocab))
+
+
+    def save_vocab(self, path):
+        """
+        Save the vocabulary of words and labels in id order, with the preprocessing parameters.
+        """
+        vocab = {"words": sorted(self.word_vocab, key=self.word_vocab.get),
+                 "labels": [l.item() if isinstance(l, np.generic) else l
+                            for l in sorted(self.label_vocab, key=self.label_vocab.get)],
+                 "score_type": self.score_type,
+                 "truncate_num": self.truncate_num,
+                 "freq_threshold": self.freq_threshold}
+        with open(path, "w") as f:
+            json.dump(vocab, f, ensure_ascii=False)
+
+
+    def load_vocab(self, path):
+        """
+        Load the vocabulary and the preprocessing parameters saved by save_vocab.
+        """
+        with open(path, "r") as f:
+            vocab = json.load(f)
+        self.word_vocab = {w: i for i, w in enumerate(vocab["words"])}
+        self.label_vocab = {l: i for i, l in enumerate(vocab["labels"])}
+        for name in ["score_type", "truncate_num", "freq_threshold"]:
+            if getattr(self, name) != vocab[name]:
+                print("Using %s=%s of the saved vocabulary, instead of %s." % (name, vocab[name], getattr(self, name)))
+            setattr(self, name, vocab[name])
+
+
     def _get_word_freq(self, data_sets_):
         """
         Build word frequency dictionary from pairs.
@@ -120,6 +222,19 @@ class ClassificationData(object):
             data_set -- the name of the dataset, train/dev/test.
         """
 
+        if self.dataset_cache:  # Parse only rows not in the binary cache.
+            self.load_cached_dataset(data_set)
+            return
+
+        # Binary signals of tokens saved by data_signaler.py, used instead of parsing their columns.
+        signals = load_signals(self.data_path, data_set, [self.score_type, "domain_knowledge"])
+
+        def _get_scores(r, id_, column):
+            if column in signals:
+                values, offsets = signals[column]
+                return values[offsets[id_]: offsets[id_ + 1]].astype(np.float64).tolist()
+            return [float(_) if _ else 0. for _ in r[column].split(" ")]
+
         # Load instances.
         self.data_sets[data_set] = ClassificationDataSet()
         data_path = os.path.join(self.data_path, data_set + ".tsv")
@@ -128,8 +243,8 @@ class ClassificationData(object):
             tokens = r["tokens"].split(" ")
             label = r["label"]
             rationale = [float(_) if _ else 0. for _ in r["rationale_annotation"].split(" ")]
-            signal = [float(_) if _ else 0. for _ in r[self.score_type].split(" ")]
-            domain = [float(_) if _ else 0. for _ in r["domain_knowledge"].split(" ")]
+            signal = _get_scores(r, id_, self.score_type)
+            domain = _get_scores(r, id_, "domain_knowledge")
             if label not in self.label_vocab:
                 self.label_vocab[label] = len(self.label_vocab)
             label = self.label_vocab[label]
@@ -138,6 +253,27 @@ class ClassificationData(object):
                                              self.truncate_num)
 
 
+    def load_cached_dataset(self, data_set):
+        """
+        Load dataset from the binary cache, updated with rows appended to the .tsv, and binary signals if any,
+        the same as load_dataset but with tokens as ids of words of the cached set.
+        Inputs:
+            data_set -- the name of the dataset, train/dev/test.
+        """
+        columns = list(dict.fromkeys(["rationale_annotation", self.score_type, "domain_knowledge"]))
+        cached = load_cached_set(self.data_path, data_set, columns)
+        self.cached_sets[data_set] = cached
+        self.data_sets[data_set] = ClassificationDataSet()
+        for id_, label in enumerate(cached.labels):
+            if label not in self.label_vocab:
+                self.label_vocab[label] = len(self.label_vocab)
+            self.data_sets[data_set].add_one(id_, cached.get_token_ids(id_), self.label_vocab[label],
+                                             cached.get_scores("rationale_annotation", id_),
+                                             cached.get_scores(self.score_type, id_),
+                                             cached.get_scores("domain_knowledge", id_),
+                                             self.truncate_num)
+
+
     def initial_embedding(self, method="random", size=100, path=None):
         """
         This function initialize embedding with glove embedding.
@@ -158,6 +294,13 @@ class ClassificationData(object):
             if method == "random":
                 return embeddings
             else:  # Load pre-trained embeddings if specified.
+                words, vectors = load_word_vectors(path)
+                if words is not None:  # Binary copy, memory-mapped.
+                    print("Loading binary embeddings of:", path)
+                    rows = [i for i, word in enumerate(words) if word in self.word_vocab]
+                    ids = [self.word_vocab[words[i]] for i in rows]
+                    embeddings[ids, :] = vectors[rows]
+                    return embeddings
                 with open(path, "r") as f:
                     print("Loading embeddings from:", path)
                     for line in f:
@@ -15,6 +15,28 @@ parser.add_argument("--config_name", type=str, default="soft_rationalizer_w_doma
                     help="Dataset name.")
 parser.add_argument("--random_seed", type=str, default=0,
                     help="Random seed")
+parser.add_argument("--quantize", type=int, default=0,
+                    help="Int8 dynamic quantized CPU inference for output/evaluate/serve, 0/1.")
+parser.add_argument("--output_format", type=str, default="binary",
+                    help="Format of output rationales, binary or tsv.")
+parser.add_argument("--num_workers", type=int, default=0,
+                    help="Number of worker processes, 0 to run in the main process.")
+parser.add_argument("--threads_per_worker", type=int, default=1,
+                    help="Number of torch threads per worker process.")
+parser.add_argument("--rationale_cache", type=int, default=0,
+                    help="Reuse cached rationales of unchanged documents in output, 0/1.")
+parser.add_argument("--dataset_cache", type=int, default=0,
+                    help="Cache parsed datasets in binary and parse only appended rows, 0/1.")
+parser.add_argument("--weight_jsonl", type=int, default=0,
+                    help="Also export word weights of analyze as JSON lines, 0/1.")
+parser.add_argument("--host", type=str, default="127.0.0.1",
+                    help="Host of the scoring service.")
+parser.add_argument("--port", type=int, default=8000,
+                    help="Port of the scoring service.")
+parser.add_argument("--max_batch_size", type=int, default=32,
+                    help="Max number of requests in a micro-batch of the scoring service.")
+parser.add_argument("--max_latency_ms", type=float, default=10,
+                    help="Max time (ms) a request waits for a micro-batch of the scoring service.")
 args, _ = parser.parse_known_args()
 args.data_path = os.path.join(args.data_dir, args.data_name)
 
@@ -32,6 +54,16 @@ if train_args.embedding_name == "glove":
 elif train_args.embedding_name == "trained":
     train_args.embedding_dir = os.path.join(args.data_path, "w2v.txt")
 train_args.working_dir = os.path.join(args.data_path, args.config_name + ".ckpt")
+train_args.quantize = args.quantize
+train_args.output_format = args.output_format
+train_args.num_workers, train_args.threads_per_worker = args.num_workers, args.threads_per_worker
+train_args.rationale_cache = args.rationale_cache
+train_args.dataset_cache = args.dataset_cache
+train_args.weight_jsonl = args.weight_jsonl
+train_args.host, train_args.port = args.host, args.port
+train_args.max_batch_size, train_args.max_latency_ms = args.max_batch_size, args.max_latency_ms
+if train_args.quantize:  # Quantized models run on CPU only.
+    train_args.cuda = 0
 
 # Set GPU chips.
 import torch
@@ -47,11 +79,19 @@ random.seed(args.random_seed)
 
 
 # Train or analyze a model.
-if args.mode in {"train", "output"}:
+if args.mode in {"train", "output", "eval", "evaluate", "quantize", "serve", "analyze"}:
 
-    # Load data.
+    # Load data, only sets a mode needs, indexed with the vocabulary saved with checkpoints if any.
     from datasets.dataset_loader import ClassificationData
-    data = ClassificationData(args.data_path, train_args)  # Load data.
+    vocab_path = os.path.join(train_args.working_dir, "vocab.json")
+    if args.mode != "train" and os.path.exists(vocab_path):
+        set_names = {"output": ["train", "dev", "test"], "eval": ["dev", "test"], "evaluate": ["dev", "test"],
+                     "quantize": ["dev", "test"], "serve": [], "analyze": []}[args.mode]
+        data = ClassificationData(args.data_path, train_args, set_names, vocab_path)  # Load data.
+        for name in ["score_type", "truncate_num", "freq_threshold"]:  # Parameters of the saved vocabulary.
+            setattr(train_args, name, getattr(data, name))
+    else:
+        data = ClassificationData(args.data_path, train_args)  # Load data.
     train_args.num_labels = len(data.label_vocab)  # Number of labels.
     print("Data successfully loaded:", data)
 
@@ -60,6 +100,7 @@ if args.mode in {"train", "output"}:
         # Initialize checkpoints.
         from utils.checkpointer import init_ckpt
         init_ckpt(train_args.working_dir)
+        data.save_vocab(vocab_path)
 
         # Initialize embeddings.
         embeddings = data.initial_embedding(train_args.embedding_method,
@@ -94,13 +135,59 @@ if args.mode in {"train", "output"}:
         outputer.output(ckpt_path, out_path, data, train_args)
         print("Rationales successfully output.")
 
+    elif args.mode in {"eval", "evaluate"}:  # Evaluate a model.
 
-elif args.mode in {"eval", "evaluate"}:
+        # Get best checkpoint.
+        from utils.checkpointer import find_best_ckpt
+        ckpt_path = find_best_ckpt(train_args.working_dir)
+        print("Best checkpoint found:", ckpt_path)
+
+        # Evaluate model.
+        from utils.quantizer import load_model
+        from runners.evaluator import evaluate
+        model = load_model(ckpt_path, quantized=bool(train_args.quantize))
+        for set_name in ["dev", "test"]:
+            print(set_name, evaluate(model, data, train_args, set_name))
+        print("Model successfully evaluated.")
+
+    elif args.mode == "quantize":  # Compare quantized inference with float32.
+
+        # Get best checkpoint.
+        from utils.checkpointer import find_best_ckpt
+        ckpt_path = find_best_ckpt(train_args.working_dir)
+        print("Best checkpoint found:", ckpt_path)
+
+        # Benchmark quantized model.
+        bench_path = os.path.join(args.data_path, args.config_name + ".quantize")
+        benchmarker = importlib.import_module("analyzers.benchmark_quantized")
+        benchmarker.benchmark(ckpt_path, bench_path, data, train_args)
+        print("Quantized model successfully benchmarked.")
+
+    elif args.mode == "serve":  # Serve a model for scoring new texts.
+
+        # Get best checkpoint.
+        from utils.checkpointer import find_best_ckpt
+        ckpt_path = find_best_ckpt(train_args.working_dir)
+        print("Best checkpoint found:", ckpt_path)
+
+        # Serve model.
+        from utils.quantizer import load_model
+        from runners.server import serve
+        model = load_model(ckpt_path, quantized=bool(train_args.quantize))
+        serve(model, data.word_vocab, data.label_vocab, args.data_path, train_args)
+
+    elif args.mode == "analyze":  # Export word weights of a linear model.
 
-    # Get best checkpoint.
-    from utils.checkpointer import find_best_ckpt
-    ckpt_path = find_best_ckpt(train_args.working_dir)
-    print("Best checkpoint found:", ckpt_path)
+        # Get best checkpoint.
+        from utils.checkpointer import find_best_ckpt
+        ckpt_path = find_best_ckpt(train_args.working_dir)
+        print("Best checkpoint found:", ckpt_path)
+
+        # Export word weights.
+        out_path = os.path.join(args.data_path, args.config_name + ".analyze")
+        analyzer = importlib.import_module("analyzers.analyze_linear")
+        analyzer.analyze(ckpt_path, out_path, data, train_args)
+        print("Model successfully analyzed.")
 
 
 elif args.mode == "binarize":
@@ -122,6 +209,15 @@ elif args.mode in {"vector", "vectorize"}:
     print("Rationales successfully vectorized.")
 
 
+elif args.mode == "benchmark_neighbors":
+
+    # Compare neighbor-based binarization with the naive one.
+    out_path = os.path.join(args.data_path, args.config_name + ".output")
+    vectorizer = importlib.import_module("analyzers.vectorize_rationales")
+    vectorizer.benchmark_neighbors(out_path, train_args.binarize_damp_factor)
+    print("Binarization successfully benchmarked.")
+
+
 elif args.mode == "cluster":
 
     # Cluster rationales.
@@ -132,6 +228,25 @@ elif args.mode == "cluster":
     print("Rationales successfully clustered.")
 
 
+elif args.mode == "benchmark_cluster":
+
+    # Compare scalable clustering with exact linkage.
+    vector_path = os.path.join(args.data_path, args.config_name + ".vector")
+    cluster_path = os.path.join(args.data_path, args.config_name + ".cluster")
+    cluster = importlib.import_module("analyzers.cluster_rationales")
+    cluster.benchmark(vector_path, cluster_path, train_args)
+    print("Clustering successfully benchmarked.")
+
+
+elif args.mode == "refresh":
+
+    # Update binary caches of sets with rows appended to them, load them with --dataset_cache=1.
+    from datasets.dataset_loader import ClassificationData
+    train_args.dataset_cache = 1
+    data = ClassificationData(args.data_path, train_args)
+    print("Dataset successfully refreshed:", {set_name: data_set.size() for set_name, data_set in data.data_sets.items()})
+
+
 elif args.mode == "test":
     
     # Test data.
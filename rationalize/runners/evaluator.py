@@ -23,6 +23,8 @@ def evaluate(model, data, args, set_name):
         # Get a batch.
         batch_idx = range(start * args.batch_size,
                           min((start + 1) * args.batch_size, instance_count))
+        if not batch_idx:  # The last batch is empty if the set size is a multiple of batch_size.
+            continue
         samples = data.get_batch(set_name, batch_idx=batch_idx, sort=True)
         x, y, m, r, s, d = samples
 
@@ -0,0 +1,237 @@
+# coding: utf-8
+
+
+import torch
+from torch.autograd import Variable
+
+import os, json, time, threading, importlib.util
+import numpy as np
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+memo_size = 100000  # Max number of token types memoized by the tokenizer of a server.
+
+
+def load_tokenizer(data_path):
+    """
+    Tokenize text the same way as the dataset cleaner.
+    Use tokenize() in data_tokenizer.py of the dataset if any, with a bounded memo, else split by spaces.
+    The module has no side effects to import, unlike data_cleaner.py seeding random generators.
+    """
+    tokenizer_path = os.path.join(data_path, "data_tokenizer.py")
+    if os.path.exists(tokenizer_path):
+        spec = importlib.util.spec_from_file_location("data_tokenizer", tokenizer_path)
+        tokenizer = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(tokenizer)
+        matcher = tokenizer.KeywordMatcher(tokenizer.masks, memo_size=memo_size)
+        return lambda text: tokenizer.tokenize(text, matcher)
+    return lambda text: text.split()
+
+
+class Scorer(object):
+    """
+    Score batches of texts with a loaded model and vocabulary.
+    """
+
+    def __init__(self, model, word_vocab, label_vocab, tokenize, args):
+        self.model = model
+        self.model.eval()
+        self.word_vocab = word_vocab
+        self.idx2label = {val: key for key, val in label_vocab.items()}
+        self.tokenize = tokenize
+        self.truncate_num = args.truncate_num
+        self.cuda = args.cuda
+
+
+    def index(self, text=None, tokens=None):
+        """
+        Tokenize a text (unless tokens are given) and index tokens with the vocabulary.
+        """
+        if tokens is None:
+            tokens = self.tokenize(text)
+        if self.truncate_num > 0:
+            tokens = tokens[:self.truncate_num]
+        unk = self.word_vocab["<UNK>"]
+        return tokens, [self.word_vocab.get(t, unk) for t in tokens]
+
+
+    def score(self, ids_list):
+        """
+        Inputs:
+            ids_list -- a list of token id lists, sorted by length in descending order.
+        Outputs:
+            labels -- a list of predicted labels.
+            rationales -- a list of per-token rationale score lists.
+        """
+        max_len = len(ids_list[0])
+        x = np.array([ids + [0] * (max_len - len(ids)) for ids in ids_list])
+        m = np.array([[1] * len(ids) + [0] * (max_len - len(ids)) for ids in ids_list])
+        x = Variable(torch.from_numpy(x))
+        m = Variable(torch.from_numpy(m)).float()
+        if self.cuda:
+            x = x.cuda()
+            m = m.cuda()
+        with torch.no_grad():
+            predict, _, z, _, _ = self.model(x, m)
+        labels = [self.idx2label[y] for y in torch.max(predict, dim=1)[1].tolist()]
+        rationales = [z_[:len(ids)] for z_, ids in zip(z.tolist(), ids_list)]
+        return labels, rationales
+
+
+class MicroBatcher(object):
+    """
+    Group concurrent requests into micro-batches by length and latency deadline.
+    A batch is flushed once max_batch_size requests are pending,
+    or once the oldest pending request has waited for max_latency seconds.
+    """
+
+    def __init__(self, scorer, max_batch_size=32, max_latency=0.01, history=10000):
+        self.scorer = scorer
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.pending = []
+        self.cond = threading.Condition()
+        self.latencies = deque(maxlen=history)
+        self.batch_sizes = deque(maxlen=history)
+        self.requests = 0
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+
+    def submit(self, ids):
+        request = {"ids": ids, "arrival": time.time(), "done": threading.Event()}
+        with self.cond:
+            self.pending.append(request)
+            self.cond.notify()
+        request["done"].wait()
+        if "error" in request:
+            raise request["error"]
+        return request["label"], request["rationale"]
+
+
+    def _take(self):
+        with self.cond:
+            while not self.pending:
+                self.cond.wait()
+            deadline = self.pending[0]["arrival"] + self.max_latency
+            while len(self.pending) < self.max_batch_size and time.time() < deadline:
+                self.cond.wait(deadline - time.time())
+            requests, self.pending = self.pending, []
+        return requests
+
+
+    def _loop(self):
+        while True:
+            requests = self._take()
+
+            # Sort by length so that each micro-batch holds requests of similar lengths.
+            requests.sort(key=lambda r: -len(r["ids"]))
+            for start in range(0, len(requests), self.max_batch_size):
+                batch = requests[start: start + self.max_batch_size]
+                try:
+                    labels, rationales = self.scorer.score([r["ids"] for r in batch])
+                    for r, label, rationale in zip(batch, labels, rationales):
+                        r["label"], r["rationale"] = label, rationale
+                except Exception as e:
+                    for r in batch:
+                        r["error"] = e
+                now = time.time()
+                with self.cond:
+                    self.requests += len(batch)
+                    self.batch_sizes.append(len(batch))
+                    self.latencies.extend(now - r["arrival"] for r in batch)
+                for r in batch:
+                    r["done"].set()
+
+
+    def stats(self):
+        with self.cond:
+            latencies = np.array(self.latencies) * 1000
+            batch_sizes = np.array(self.batch_sizes)
+            requests = self.requests
+        if not requests:
+            return {"requests": 0}
+        return {
+            "requests": requests,
+            "latency_ms": {"p50": float(np.percentile(latencies, 50)),
+                           "p99": float(np.percentile(latencies, 99))},
+            "batch_size": {"mean": float(batch_sizes.mean()),
+                           "p50": float(np.percentile(batch_sizes, 50)),
+                           "max": int(batch_sizes.max())},
+        }
+
+
+class _Server(ThreadingHTTPServer):
+    request_queue_size = 1024  # Accept bursts of concurrent connections.
+    daemon_threads = True
+
+
+def _make_handler(scorer, batcher):
+
+    class Handler(BaseHTTPRequestHandler):
+        """
+        POST /score {"text": "..."} or {"tokens": [...]}
+            -> {"label": "...", "tokens": [...], "rationale": [...]}.
+        GET /stats -> latency and batch size stats.
+        """
+
+        def _reply(self, code, body):
+            body = json.dumps(body).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._reply(200, batcher.stats())
+            else:
+                self._reply(404, {"error": "Not found."})
+
+        def do_POST(self):
+            if self.path != "/score":
+                self._reply(404, {"error": "Not found."})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                query = json.loads(self.rfile.read(length).decode("utf-8"))
+                tokens, ids = scorer.index(query.get("text"), query.get("tokens"))
+            except Exception as e:
+                self._reply(400, {"error": str(e)})
+                return
+            if not ids:
+                self._reply(400, {"error": "Empty text."})
+                return
+            try:
+                label, rationale = batcher.submit(ids)
+            except Exception as e:
+                self._reply(500, {"error": str(e)})
+                return
+            self._reply(200, {"label": label, "tokens": tokens, "rationale": rationale})
+
+        def log_message(self, format, *args):  # Silence per-request logs.
+            pass
+
+    return Handler
+
+
+def serve(model, word_vocab, label_vocab, data_path, args):
+    """
+    Serve a model over HTTP until interrupted, with model and vocabulary loaded once.
+    Inputs:
+        args.host, args.port -- address to listen on.
+        args.max_batch_size -- max number of requests in a micro-batch.
+        args.max_latency_ms -- max time a request waits for a micro-batch.
+    """
+    scorer = Scorer(model, word_vocab, label_vocab, load_tokenizer(data_path), args)
+    batcher = MicroBatcher(scorer, args.max_batch_size, args.max_latency_ms / 1000.)
+    server = _Server((args.host, args.port), _make_handler(scorer, batcher))
+    print("Serving on http://%s:%d (POST /score, GET /stats)." % (args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    print(batcher.stats())
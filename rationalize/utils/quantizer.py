@@ -0,0 +1,27 @@
+# coding: utf-8
+
+
+import torch
+import torch.nn as nn
+
+
+# Layers to quantize, GRU is only swapped by torch versions that support it.
+quantizable_layers = {nn.LSTM, nn.GRU, nn.Linear}
+
+
+# Apply int8 dynamic quantization to a model for CPU inference.
+def quantize(model):
+    model = model.cpu()
+    model.eval()
+    return torch.quantization.quantize_dynamic(model, quantizable_layers, dtype=torch.qint8)
+
+
+# Load a model from checkpoint, on CPU if specified, quantized models are always on CPU.
+def load_model(ckpt_path, cpu=False, quantized=False):
+    if not (cpu or quantized):
+        return torch.load(ckpt_path)
+    model = torch.load(ckpt_path, map_location="cpu")
+    model.use_cuda = 0
+    if quantized:
+        model = quantize(model)
+    return model
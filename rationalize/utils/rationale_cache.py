@@ -0,0 +1,99 @@
+# coding: utf-8
+
+
+import os, json, hashlib
+import numpy as np
+
+
+# Files of the rationale cache.
+cache_files = {"meta": "meta.json", "keys": "keys.npy", "offsets": "offsets.npy",
+               "rationale_pred": "rationale_pred.f32"}
+
+
+# Fingerprint a checkpoint with the vocabulary and options that change its rationales.
+def fingerprint(ckpt_path, word_vocab, args):
+    sha1 = hashlib.sha1()
+    with open(ckpt_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(block)
+    vocab = json.dumps(sorted(word_vocab.items(), key=lambda kv: kv[1]), ensure_ascii=False)
+    sha1.update(vocab.encode("utf-8"))
+    sha1.update(json.dumps({"truncate_num": args.truncate_num,
+                            "quantize": bool(args.quantize)}).encode("utf-8"))
+    return sha1.hexdigest()
+
+
+# Key a document by its token ids.
+def doc_key(tokens):
+    return hashlib.sha1(np.asarray(tokens, dtype=np.int64).tobytes()).hexdigest()
+
+
+class RationaleCache(object):
+    """
+    Cache of float32 predicted rationales without <PAD>, keyed by token id hash.
+    The cache is dropped if the checkpoint fingerprint changes,
+    and only entries used since loading are kept on save.
+    """
+
+    def __init__(self, cache_path, fingerprint_):
+        self.path = cache_path
+        self.fingerprint = fingerprint_
+        self.entries = {}
+        self.used = {}
+        self.hits = 0
+        self.misses = 0
+
+        meta_path = os.path.join(cache_path, cache_files["meta"])
+        if not os.path.exists(meta_path):
+            return
+        with open(meta_path, "r") as f:
+            if json.load(f)["fingerprint"] != fingerprint_:
+                print("Rationale cache invalidated.")
+                return
+        keys = np.load(os.path.join(cache_path, cache_files["keys"]))
+        offsets = np.load(os.path.join(cache_path, cache_files["offsets"]))
+        values = np.fromfile(os.path.join(cache_path, cache_files["rationale_pred"]), dtype=np.float32)
+        for i, key in enumerate(keys.tolist()):
+            self.entries[key] = values[offsets[i]: offsets[i + 1]]
+
+
+    def lookup(self, keys):
+        """
+        Count hits and misses of keys, and return indexes of missed keys.
+        """
+        misses = []
+        for i, key in enumerate(keys):
+            if key in self.entries:
+                self.used[key] = self.entries[key]
+                self.hits += 1
+            else:
+                misses.append(i)
+                self.misses += 1
+        return misses
+
+
+    def get(self, key):
+        return self.used[key]
+
+
+    def put(self, key, z):
+        self.used[key] = np.array(z, dtype=np.float32)
+
+
+    def save(self):
+        if not os.path.exists(self.path):
+            os.mkdir(self.path)
+        keys = list(self.used.keys())
+        lens = [len(self.used[key]) for key in keys]
+        offsets = np.concatenate([[0], np.cumsum(lens, dtype=np.int64)])
+        np.save(os.path.join(self.path, cache_files["keys"]), np.array(keys, dtype="U40"))
+        np.save(os.path.join(self.path, cache_files["offsets"]), offsets)
+        with open(os.path.join(self.path, cache_files["rationale_pred"]), "wb") as f:
+            for key in keys:
+                self.used[key].tofile(f)
+        with open(os.path.join(self.path, cache_files["meta"]), "w") as f:
+            json.dump({"fingerprint": self.fingerprint, "size": len(keys)}, f)
+
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,191 @@
+# coding: utf-8
+
+
+import os, shutil, threading, queue
+import numpy as np
+import pandas as pd
+
+
+# Files of the binary rationale format, one folder per set.
+binary_files = {"index": "index.npy", "offsets": "offsets.npy",
+                "rationale_true": "rationale_true", "rationale_pred": "rationale_pred"}
+binary_dtypes = {".f16": np.float16, ".f32": np.float32}
+
+
+class RationaleWriter(object):
+    """
+    Write rationales of a set from a background thread.
+    Formats:
+        binary -- unpadded float16 (or float32) rationales of all instances concatenated,
+                  with an id index and offsets, in out_path/set_name/.
+        tsv -- padded rationales as space-joined text, in out_path/set_name.tsv.
+    """
+
+    def __init__(self, out_path, set_name, output_format="binary", precision=".f16"):
+        self.output_format = output_format
+        self.precision = precision
+        binary_path = os.path.join(out_path, set_name)
+        tsv_path = os.path.join(out_path, set_name + ".tsv")
+        if output_format == "binary":
+            if os.path.exists(tsv_path):  # Remove stale rationales in the other format.
+                os.remove(tsv_path)
+            self.path = binary_path
+            if os.path.exists(self.path):  # Start from an empty folder.
+                shutil.rmtree(self.path)
+            os.mkdir(self.path)
+            self.f_true = open(os.path.join(self.path, binary_files["rationale_true"] + precision), "wb")
+            self.f_pred = open(os.path.join(self.path, binary_files["rationale_pred"] + precision), "wb")
+            self.ids = []
+            self.lens = []
+        elif output_format == "tsv":
+            if os.path.exists(binary_path):  # Remove stale rationales in the other format.
+                shutil.rmtree(binary_path)
+            self.path = tsv_path
+            self.f = open(self.path, "w")
+            self.f.write("index\trationale_true\trationale_pred\tmask\n")
+        else:
+            raise ValueError("Unknown output format: %s" % output_format)
+        self.queue = queue.Queue(maxsize=64)
+        self.error = None  # Exception raised by the writing thread, re-raised by write() and close().
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+
+    def write(self, ids, r, z, m):
+        """
+        Queue a padded batch to write.
+        Inputs:
+            ids -- ids of instances, shape (batch_size,).
+            r -- rationale annotation, shape (batch_size, seq_len).
+            z -- predicted rationale, shape (batch_size, seq_len).
+            m -- mask, shape (batch_size, seq_len).
+        """
+        self._raise_error()
+        self.queue.put((np.asarray(ids), np.asarray(r), np.asarray(z), np.asarray(m)))
+
+
+    def _write_binary(self, ids, r, z, m):
+        lens = m.sum(axis=1).astype(np.int64)
+        valid = np.arange(m.shape[1])[None, :] < lens[:, None]
+        r[valid].astype(binary_dtypes[self.precision]).tofile(self.f_true)
+        z[valid].astype(binary_dtypes[self.precision]).tofile(self.f_pred)
+        self.ids.extend(ids.tolist())
+        self.lens.extend(lens.tolist())
+
+
+    def _write_tsv(self, ids, r, z, m):
+        z = [" ".join([str(z__) for z__ in z_]) for z_ in z.tolist()]
+        r = [" ".join([str(r__) for r__ in r_]) for r_ in r.tolist()]
+        m = [" ".join([str(m__) for m__ in m_]) for m_ in m.tolist()]
+        for id_, z_, r_, m_ in zip(ids.tolist(), z, r, m):
+            line = str(id_) + "\t" + r_ + "\t" + z_ + "\t" + m_ + "\n"
+            self.f.write(line)
+
+
+    def _loop(self):
+        write = self._write_binary if self.output_format == "binary" else self._write_tsv
+        while True:
+            batch = self.queue.get()
+            if batch is None:
+                break
+            if self.error is not None:  # Keep draining, so write() and close() do not block.
+                continue
+            try:
+                write(*batch)
+            except Exception as e:
+                self.error = e
+
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise RuntimeError("Failed to write rationales to %s." % self.path) from self.error
+
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.output_format == "binary":
+            self.f_true.close()
+            self.f_pred.close()
+            self._raise_error()
+            offsets = np.concatenate([[0], np.cumsum(self.lens, dtype=np.int64)])
+            np.save(os.path.join(self.path, binary_files["index"]), np.array(self.ids, dtype=np.int64))
+            np.save(os.path.join(self.path, binary_files["offsets"]), offsets)
+        else:
+            self.f.close()
+            self._raise_error()
+
+
+class RationaleReader(object):
+    """
+    Read unpadded rationales of a set, from the binary format (memory-mapped) if any,
+    otherwise parsed from the tsv format.
+    This stores:
+        ids -- ids of instances, shape (instance_count,).
+        offsets -- offsets of instances, shape (instance_count + 1,),
+                   rationales of the ith instance are [offsets[i], offsets[i + 1]).
+        rationale_true -- rationale annotations of all instances, shape (token_count,).
+        rationale_pred -- predicted rationales of all instances, shape (token_count,).
+    """
+
+    def __init__(self, out_path, set_name):
+        binary_path = os.path.join(out_path, set_name)
+        if os.path.exists(os.path.join(binary_path, binary_files["offsets"])):
+            self._read_binary(binary_path)
+        else:
+            self._read_tsv(os.path.join(out_path, set_name + ".tsv"))
+
+
+    def _read_binary(self, path):
+        self.ids = np.load(os.path.join(path, binary_files["index"]))
+        self.offsets = np.load(os.path.join(path, binary_files["offsets"]))
+        for name in ["rationale_true", "rationale_pred"]:
+            for precision, dtype in binary_dtypes.items():
+                file_path = os.path.join(path, binary_files[name] + precision)
+                if not os.path.exists(file_path):
+                    continue
+                if self.offsets[-1] > 0:
+                    setattr(self, name, np.memmap(file_path, dtype=dtype, mode="r"))
+                else:  # Empty files can not be memory-mapped.
+                    setattr(self, name, np.zeros(0, dtype=dtype))
+
+
+    def _read_tsv(self, path):
+        df = pd.read_csv(path, sep="\t", dtype={"rationale_true": str, "rationale_pred": str, "mask": str})
+        lens = df["mask"].apply(lambda m: int(sum(float(_) for _ in m.split(" "))))
+        self.ids = df["index"].values.astype(np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(lens.values, dtype=np.int64)])
+        for name in ["rationale_true", "rationale_pred"]:
+            values = [np.array(v.split(" ")[:l], dtype=np.float64) for v, l in zip(df[name], lens)]
+            setattr(self, name, np.concatenate(values) if values else np.zeros(0))
+
+
+    def __len__(self):
+        return len(self.ids)
+
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+
+    def get(self, i):
+        """
+        Get rationale annotation and predicted rationale of the ith instance.
+        """
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.rationale_true[start: end], self.rationale_pred[start: end]
+
+
+    def to_frame(self):
+        """
+        Get a dataframe of instances, with columns index, rationale_true and rationale_pred,
+        rationales are lists of floats without <PAD>.
+        """
+        rationale_true, rationale_pred = [], []
+        for i in range(len(self)):
+            true, pred = self.get(i)
+            rationale_true.append(true.astype(np.float64).tolist())
+            rationale_pred.append(pred.astype(np.float64).tolist())
+        return pd.DataFrame({"index": self.ids,
+                             "rationale_true": rationale_true,
+                             "rationale_pred": rationale_pred})
@@ -0,0 +1,75 @@
+# coding: utf-8
+
+
+import os, json, hashlib
+import numpy as np
+
+
+cache_name = "dataset_cache"  # Cache directory in the dataset directory.
+signal_name = "signals"  # Binary signals of tokens of a set, in [cache_name]/[SET]/[signal_name]/.
+
+
+def sha1(path, size=None):
+    """
+    SHA-1 of the first size bytes of a file, or of all of it.
+    """
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        while size is None or size > 0:
+            block = f.read(1 << 20 if size is None else min(size, 1 << 20))
+            if not block:
+                break
+            digest.update(block)
+            if size is not None:
+                size -= len(block)
+    return digest.hexdigest()
+
+
+def split_set_path(tsv_path):
+    """
+    Dataset directory and set name of a .tsv, e.g., "" and "train" of train.tsv.
+    """
+    return os.path.dirname(tsv_path), os.path.splitext(os.path.basename(tsv_path))[0]
+
+
+def get_signal_path(data_path, set_name):
+    return os.path.join(data_path, cache_name, set_name, signal_name)
+
+
+def save_signals(data_path, set_name, columns):
+    """
+    Save signals of tokens of documents of data_path/set_name.tsv, e.g., {"linear_signal": [array, ...]},
+    as all documents concatenated in [COLUMN].npy, with offsets of documents in offsets.npy,
+    and the size and SHA-1 of the .tsv they are valid for in meta.json.
+    """
+    tsv_path = os.path.join(data_path, set_name + ".tsv")
+    path = get_signal_path(data_path, set_name)
+    if not os.path.exists(path):
+        os.makedirs(path)
+    lens = [len(v) for v in next(iter(columns.values()))]
+    for column, values in columns.items():
+        np.save(os.path.join(path, column + ".npy"), np.concatenate(values) if values else np.zeros(0))
+    np.save(os.path.join(path, "offsets.npy"), np.concatenate([[0], np.cumsum(lens, dtype=np.int64)]))
+    with open(os.path.join(path, "meta.json"), "w") as f:  # Last, to mark the signals complete.
+        json.dump({"size": os.path.getsize(tsv_path), "sha1": sha1(tsv_path), "columns": list(columns)}, f)
+
+
+def load_signals(data_path, set_name, columns):
+    """
+    Load signals of tokens saved by save_signals(), if saved for data_path/set_name.tsv as it is.
+    Outputs:
+        signals -- {column: [values, offsets]} of columns in the signals, empty if there are none,
+                   values of the ith document are values[offsets[i]: offsets[i + 1]].
+    """
+    tsv_path = os.path.join(data_path, set_name + ".tsv")
+    path = get_signal_path(data_path, set_name)
+    if not os.path.exists(os.path.join(path, "meta.json")):
+        return {}
+    with open(os.path.join(path, "meta.json"), "r") as f:
+        meta = json.load(f)
+    if meta["size"] != os.path.getsize(tsv_path) or sha1(tsv_path, meta["size"]) != meta["sha1"]:
+        print("Signals of %s are stale, run data_signaler.py again." % set_name)
+        return {}
+    offsets = np.load(os.path.join(path, "offsets.npy"))
+    return {column: [np.load(os.path.join(path, column + ".npy")), offsets]
+            for column in columns if column in meta["columns"]}
@@ -0,0 +1,30 @@
+# coding: utf-8
+
+
+import os, json
+import numpy as np
+
+
+def binary_paths(path):
+    """
+    Paths of the binary copy of a text embedding file, e.g., w2v.npy and w2v.vocab.json of w2v.txt.
+    """
+    base = os.path.splitext(path)[0]
+    return base + ".npy", base + ".vocab.json"
+
+
+def load_word_vectors(path):
+    """
+    Load word vectors from the binary copy of a text embedding file, if saved after the text.
+    Outputs:
+        words -- words in order, or None if there is no up-to-date binary copy.
+        vectors -- memory-mapped float32 vectors of words, shape (vocab_size, embedding_dim).
+    """
+    vector_path, vocab_path = binary_paths(path)
+    if not os.path.exists(vector_path) or not os.path.exists(vocab_path):
+        return None, None
+    if os.path.exists(path) and os.path.getmtime(path) > os.path.getmtime(vector_path):  # Stale.
+        return None, None
+    with open(vocab_path, "r") as f:
+        words = json.load(f)
+    return words, np.load(vector_path, mmap_mode="r")